@@ -2,12 +2,16 @@ from __future__ import annotations
 
 from typing import TYPE_CHECKING, Optional, Tuple
 
+import tile_types
+
 if TYPE_CHECKING:
     from engine import Engine
     from entity import Entity, Actor
 
 
 class Action:
+    __slots__ = ("entity",)
+
     def __init__(self, entity: Actor) -> None:
         super().__init__()
         self.entity = entity
@@ -73,22 +77,23 @@ class MeleeAction(ActionWithDirection):
 
         damage = self.entity.fighter.power - target.fighter.defense
 
-        attack_desc = f"{self.entity.name.capitalize()} attacks {target.name}"
+        self.report(self.entity, target, damage)
         if damage > 0:
-            print(f"{attack_desc} for {damage} hit points.")
             target.fighter.hp -= damage
-        else:
-            print(f"{attack_desc} but does no damage")
+
+    @staticmethod
+    def report(attacker: Actor, target: Actor, damage: int) -> None:
+        engine = attacker.game_map.engine
+        engine.message_log.add(engine.turn, "attack", attacker.name, target.name, damage)
 
 
 class MovementAction(ActionWithDirection):
     def perform(self) -> None:
         dest_x, dest_y = self.dest_xy
 
-        print(self.entity.map_x, ", ", self.entity.map_y)
         if not self.engine.game_map.in_bounds(dest_x, dest_y):
             return  # Destination is out of bounds.
-        if not self.engine.game_map.map_tiles["walkable"][dest_x, dest_y]:
+        if not tile_types.WALKABLE[self.engine.game_map.map_tiles[dest_x, dest_y]]:
             return  # Destination is blocked by a tile.
         if self.engine.game_map.get_blocking_entity_at_location(dest_x, dest_y):
             return  # Destination is blocked by an entity.
@@ -0,0 +1,5 @@
+"""
+Micro-benchmarks for the engine's hot paths (procgen, FOV, rendering, enemy turns and pathfinding).
+
+Run from the repository root with `python -m benchmarks --help`.
+"""
@@ -0,0 +1,82 @@
+"""
+Command line entry point for the benchmarks.
+
+    python -m benchmarks --output results.json
+    python -m benchmarks --sizes 80x45 200x200 --entities 10 100 --baseline results.json
+
+With --baseline, every result is compared to the matching entry of a previously saved run and anything slower than
+the threshold is flagged as a regression (the exit code is then 1).
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import platform
+import sys
+import time
+from typing import Dict, List, Tuple
+
+from benchmarks.cases import CASE_NAMES, ENTITY_COUNTS, MAP_SIZES, run_benchmarks
+
+
+def parse_size(text: str) -> Tuple[int, int]:
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+
+def compare(results: List[Dict[str, object]], baseline: List[Dict[str, object]], threshold: float) -> int:
+    """Print each result next to its baseline and return the number of regressions."""
+    baseline_by_key = {(entry["case"], entry["map"], entry["entities"]): entry for entry in baseline}
+    regressions = 0
+    for entry in results:
+        old = baseline_by_key.get((entry["case"], entry["map"], entry["entities"]))
+        if old is None:
+            continue
+        # The best time is much less noisy than the median, so that's what gets compared.
+        ratio = entry["best"] / old["best"]
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        elif ratio < 1 - threshold:
+            flag = "  improved"
+        print(
+            f"{entry['case']:>20} {entry['map']:>10} {entry['entities']:>6}: "
+            f"{old['best'] * 1000:10.3f} ms -> {entry['best'] * 1000:10.3f} ms ({ratio:5.2f}x){flag}"
+        )
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", nargs="+", type=parse_size, default=MAP_SIZES, metavar="WxH")
+    parser.add_argument("--entities", nargs="+", type=int, default=ENTITY_COUNTS)
+    parser.add_argument("--cases", nargs="+", choices=CASE_NAMES, default=CASE_NAMES)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    parser.add_argument("--baseline", help="Compare against the results saved in this JSON file.")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="Relative slowdown that counts as a regression (default 0.10 = 10%%).")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.sizes, args.entities, args.cases, args.repeat)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "results": results,
+            }, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
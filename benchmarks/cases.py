@@ -0,0 +1,218 @@
+from __future__ import annotations
+
+import random
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np  # type: ignore
+import tcod
+
+from engine import Engine
+import entity_factories
+import level_io
+from procgen import generate_dungeon
+import tile_types
+
+MAP_SIZES: List[Tuple[int, int]] = [(80, 45), (200, 200), (500, 500), (1000, 1000), (2000, 2000)]
+ENTITY_COUNTS: List[int] = [10, 100, 1000, 10000]
+
+VIEW_WIDTH = 80
+VIEW_HEIGHT = 45
+
+
+class Timed(NamedTuple):
+    function: Callable[[], None]
+    # Run before every call of function, outside of the timing. For cases that change the state they measure.
+    setup: Optional[Callable[[], None]] = None
+
+
+# A benchmark case takes a prepared engine and returns what gets timed, or None if it can't run on that engine.
+Case = Callable[[Engine], Optional[Timed]]
+
+
+def rooms_for_size(map_width: int, map_height: int) -> int:
+    """Scale the room count with the map area, using main.py's 30 rooms per 80x45 as the density."""
+    return max(30, int(30 * map_width * map_height / (80 * 45)))
+
+
+def generate(map_width: int, map_height: int, seed: int = 0) -> Engine:
+    """Generate a dungeon without any monsters."""
+    random.seed(seed)
+    player = entity_factories.player.clone()
+    engine = Engine(player=player)
+    engine.game_map = generate_dungeon(
+        max_rooms=rooms_for_size(map_width, map_height),
+        room_min_size=6,
+        room_max_size=10,
+        map_width=map_width,
+        map_height=map_height,
+        view_width=VIEW_WIDTH,
+        view_height=VIEW_HEIGHT,
+        max_monsters_per_room=0,
+        engine=engine,
+    )
+    return engine
+
+
+def populate(engine: Engine, entity_count: int, seed: int = 0) -> int:
+    """
+    Spawn monsters on random free floor tiles, preferring the ones closest to the player so that the FOV, render and
+    AI cases actually have something to do. Returns the number spawned, which is capped by the free floor space.
+    """
+    game_map = engine.game_map
+    player = engine.player
+    free = tile_types.WALKABLE[game_map.map_tiles] & (game_map.entity_ids < 0)
+    xs, ys = np.nonzero(free)
+
+    rng = np.random.RandomState(seed)
+    distance = np.maximum(abs(xs - player.map_x), abs(ys - player.map_y)) + rng.random_sample(xs.size)
+    chosen = np.argsort(distance)[:entity_count]
+    for index in chosen:
+        entity_factories.orc.spawn(game_map, int(xs[index]), int(ys[index]))
+
+    # Keep the player alive no matter how long the benchmark runs.
+    player.fighter.max_hp = player.fighter.hp = 10 ** 9
+    engine.update_fov()
+    return len(chosen)
+
+
+def case_update_fov(engine: Engine) -> Timed:
+    def update_fov() -> None:
+        engine.invalidate_fov()  # Otherwise every call after the first returns early, as nothing moved.
+        engine.update_fov()
+
+    return Timed(update_fov)
+
+
+def case_render(engine: Engine) -> Timed:
+    """A frame composed from scratch, like after the camera moves."""
+    console = tcod.Console(80, 50, order="F")
+
+    def render() -> None:
+        engine.game_map.invalidate_render_cache()  # Otherwise every call after the first reuses the cached tiles.
+        engine.game_map.render(console)
+        console.clear()
+
+    return Timed(render)
+
+
+def case_render_cached(engine: Engine) -> Timed:
+    """A frame where nothing changed since the last one, so the cached tile layer is reused."""
+    console = tcod.Console(80, 50, order="F")
+
+    def render() -> None:
+        engine.game_map.render(console)
+        console.clear()
+
+    return Timed(render)
+
+
+def case_handle_enemy_turns(engine: Engine) -> Timed:
+    """
+    Every call starts from the level as populate() left it, rebuilt from a packed copy, since enemy turns move the
+    enemies (and put the ones with nothing to do to sleep).
+    """
+    player = engine.player
+    start = player.map_x, player.map_y
+    arrays = level_io.pack_level(engine.game_map, exclude=player)
+
+    def setup() -> None:
+        game_map = level_io.unpack_level(arrays, engine, VIEW_WIDTH, VIEW_HEIGHT)
+        player.place(*start, game_map)
+        player.fighter.hp = player.fighter.max_hp
+        engine.game_map = game_map
+        engine.update_fov()
+
+    return Timed(engine.handle_enemy_turns, setup)
+
+
+def case_get_path_to(engine: Engine) -> Optional[Timed]:
+    player = engine.player
+    enemies = [actor for actor in engine.game_map.actors if actor is not player]
+    if not enemies:
+        return None
+    # Path from the furthest enemy, which is the expensive case.
+    enemy = max(enemies, key=lambda actor: abs(actor.map_x - player.map_x) + abs(actor.map_y - player.map_y))
+
+    def get_path_to() -> None:
+        enemy.ai.get_path_to(player.map_x, player.map_y)
+
+    return Timed(get_path_to)
+
+
+# Cases that run on a populated map, keyed by name.
+ENTITY_CASES: Dict[str, Case] = {
+    "update_fov": case_update_fov,
+    "render": case_render,
+    "render_cached": case_render_cached,
+    "handle_enemy_turns": case_handle_enemy_turns,
+    "get_path_to": case_get_path_to,
+}
+CASE_NAMES = ["generate_dungeon", *ENTITY_CASES]
+
+
+def time_function(
+        function: Callable[[], None], repeat: int, min_time: float = 0.05, setup: Optional[Callable[[], None]] = None,
+) -> Dict[str, float]:
+    """
+    Time a function. Each sample runs it enough times to last at least `min_time` seconds, to keep timer noise out
+    of the fast cases. Returns per-call seconds.
+
+    If setup is given it's called before every call of function, and only function itself is timed.
+    """
+    def timed_call() -> float:
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        return time.perf_counter() - start
+
+    loops = max(1, int(min_time / max(timed_call(), 1e-9)))
+
+    samples = []
+    for _ in range(repeat):
+        if setup is None:
+            start = time.perf_counter()
+            for _ in range(loops):
+                function()
+            samples.append((time.perf_counter() - start) / loops)
+        else:
+            samples.append(sum(timed_call() for _ in range(loops)) / loops)
+
+    return {"best": min(samples), "median": float(np.median(samples)), "loops": loops}
+
+
+def run_benchmarks(
+        map_sizes: List[Tuple[int, int]],
+        entity_counts: List[int],
+        cases: Optional[List[str]] = None,
+        repeat: int = 5,
+        log: Callable[[str], None] = print,
+) -> List[Dict[str, object]]:
+    """Run each selected case across the map sizes (and entity counts) and return one result per combination."""
+    cases = cases or CASE_NAMES
+    results: List[Dict[str, object]] = []
+
+    for map_width, map_height in map_sizes:
+        size = f"{map_width}x{map_height}"
+        if "generate_dungeon" in cases:
+            result = time_function(lambda: generate(map_width, map_height), repeat, min_time=0)
+            results.append({"case": "generate_dungeon", "map": size, "entities": 0, **result})
+            log(f"generate_dungeon {size}: {result['median'] * 1000:.3f} ms")
+
+        for entity_count in entity_counts:
+            selected = [name for name in cases if name in ENTITY_CASES]
+            if not selected:
+                break
+            engine = generate(map_width, map_height)
+            spawned = populate(engine, entity_count)
+            for name in selected:
+                timed = ENTITY_CASES[name](engine)
+                if timed is None:
+                    log(f"{name} {size} {spawned} entities: skipped")
+                    continue
+                result = time_function(timed.function, repeat, setup=timed.setup)
+                results.append({"case": name, "map": size, "entities": spawned, **result})
+                log(f"{name} {size} {spawned} entities: {result['median'] * 1000:.3f} ms")
+
+    return results
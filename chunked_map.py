@@ -0,0 +1,253 @@
+from __future__ import annotations
+
+import operator
+import os
+from collections import OrderedDict
+from typing import Any, Callable, Iterable, Optional, Tuple, TYPE_CHECKING
+
+import numpy as np  # type: ignore
+
+from game_map import GameMap
+
+if TYPE_CHECKING:
+    from engine import Engine
+    from entity import Entity
+
+# Called with (chunk_x, chunk_y, chunk) to fill in a freshly allocated chunk. The hook must only write into the array
+# it's given; it can't read back from the same store while the chunk is being generated.
+ChunkHook = Callable[[int, int, np.ndarray], None]
+
+
+class ChunkStore:
+    """
+    A 2D array split into fixed-size square chunks that only exist once something touches them.
+
+    Supports the subset of numpy indexing the game uses on its map layers: store[x, y] and store[x0:x1, y0:y1] for
+    reading and writing. Reads return plain numpy arrays (copies, not views).
+
+    New chunks start out as fill_value and are then passed to generate_chunk, if there is one. Only max_hot_chunks
+    chunks are kept in memory. When spill_path is set, the least recently used chunks are written out to a
+    numpy.memmap at that path and read back when they are needed again. Without a spill_path nothing is ever evicted.
+    The spill file holds one slot per chunk that has been evicted so far, and grows as more chunks are, so its size
+    follows the area that was visited rather than the world size. Call close() to delete it.
+    """
+
+    def __init__(
+            self,
+            shape: Tuple[int, int],
+            dtype: Any,
+            fill_value: Any,
+            chunk_size: int = 64,
+            generate_chunk: Optional[ChunkHook] = None,
+            max_hot_chunks: int = 256,
+            spill_path: Optional[str] = None,
+    ):
+        self.shape = shape
+        self.dtype = np.dtype(dtype)
+        self.fill_value = fill_value
+        self.chunk_size = chunk_size
+        self.generate_chunk = generate_chunk
+        self.max_hot_chunks = max_hot_chunks
+        self.spill_path = spill_path
+
+        self.chunks_shape = (-(-shape[0] // chunk_size), -(-shape[1] // chunk_size))
+        self._hot: OrderedDict[Tuple[int, int], np.ndarray] = OrderedDict()
+        self._cold: Optional[np.memmap] = None  # One (chunk_size, chunk_size) slot per spilled chunk.
+        self._slots = np.full(self.chunks_shape, -1, dtype=np.int32, order="F")  # Each chunk's slot, or -1.
+        self._used_slots = 0
+
+    @property
+    def hot_chunks(self) -> int:
+        """Number of chunks currently held in memory."""
+        return len(self._hot)
+
+    def chunk(self, chunk_x: int, chunk_y: int) -> np.ndarray:
+        """Return the in-memory array for a chunk, loading or generating it first if needed."""
+        key = chunk_x, chunk_y
+        chunk = self._hot.get(key)
+        if chunk is not None:
+            self._hot.move_to_end(key)
+            return chunk
+
+        slot = self._slots[key]
+        if slot >= 0:
+            chunk = np.array(self._cold[slot], order="F")
+        else:
+            chunk = np.full((self.chunk_size, self.chunk_size), fill_value=self.fill_value, dtype=self.dtype,
+                            order="F")
+            if self.generate_chunk:
+                self.generate_chunk(chunk_x, chunk_y, chunk)
+
+        self._hot[key] = chunk
+        self._evict()
+        return chunk
+
+    def _evict(self) -> None:
+        if self.spill_path is None:
+            return  # Nowhere to put cold chunks, so everything stays in memory.
+        while len(self._hot) > self.max_hot_chunks:
+            key, chunk = self._hot.popitem(last=False)
+            slot = self._slots[key]
+            if slot < 0:
+                slot = self._slots[key] = self._used_slots
+                self._used_slots += 1
+                if self._cold is None or slot >= len(self._cold):
+                    self._grow_spill_file()
+            self._cold[slot] = chunk
+
+    def _grow_spill_file(self) -> None:
+        """Make room for more slots in the spill file, doubling it (memmap extends the file when opened bigger)."""
+        slots = 64
+        mode = "w+"
+        if self._cold is not None:
+            slots = 2 * len(self._cold)
+            mode = "r+"
+            self._cold.flush()
+            self._cold = None  # The old mapping has to go before the file can be mapped again at the new size.
+        self._cold = np.memmap(
+            self.spill_path, dtype=self.dtype, mode=mode, shape=(slots, self.chunk_size, self.chunk_size),
+        )
+
+    def reset(self) -> None:
+        """Drop every chunk, so the whole store reads as fill_value again (or gets regenerated)."""
+        self._hot.clear()
+        self._slots[:] = -1
+        self._used_slots = 0
+
+    def close(self) -> None:
+        """Drop every chunk and delete the spill file, if one was created."""
+        self.reset()
+        if self._cold is not None:
+            self._cold = None
+            os.remove(self.spill_path)
+
+    def _normalize(self, key: Any) -> Tuple[Tuple[int, int], Tuple[int, int], bool]:
+        """Turn an index into ((x0, x1), (y0, y1), is_scalar) using numpy's rules for ints and slices."""
+        if not isinstance(key, tuple):
+            key = (key, slice(None))
+        if len(key) != 2:
+            raise IndexError(f"ChunkStore takes 2 indices, got {len(key)}")
+
+        ranges = []
+        scalar = True
+        for index, size in zip(key, self.shape):
+            if isinstance(index, slice):
+                start, stop, step = index.indices(size)
+                if step != 1:
+                    raise IndexError("ChunkStore does not support slice steps")
+                ranges.append((start, max(start, stop)))
+                scalar = False
+            else:
+                index = operator.index(index)
+                if index < 0:
+                    index += size
+                if not 0 <= index < size:
+                    raise IndexError(f"index {index} is out of bounds for size {size}")
+                ranges.append((index, index + 1))
+        return ranges[0], ranges[1], scalar
+
+    def _overlapping_chunks(
+            self, x_range: Tuple[int, int], y_range: Tuple[int, int]
+    ) -> Iterable[Tuple[int, int, slice, slice, slice, slice]]:
+        """Yield (chunk_x, chunk_y, chunk slices, window slices) for each chunk a window overlaps."""
+        size = self.chunk_size
+        (x0, x1), (y0, y1) = x_range, y_range
+        for chunk_x in range(x0 // size, (x1 - 1) // size + 1):
+            left, right = max(x0, chunk_x * size), min(x1, (chunk_x + 1) * size)
+            for chunk_y in range(y0 // size, (y1 - 1) // size + 1):
+                top, bottom = max(y0, chunk_y * size), min(y1, (chunk_y + 1) * size)
+                yield (
+                    chunk_x, chunk_y,
+                    slice(left - chunk_x * size, right - chunk_x * size),
+                    slice(top - chunk_y * size, bottom - chunk_y * size),
+                    slice(left - x0, right - x0),
+                    slice(top - y0, bottom - y0),
+                )
+
+    def __getitem__(self, key: Any) -> Any:
+        (x0, x1), (y0, y1), scalar = self._normalize(key)
+        if scalar:
+            chunk = self.chunk(x0 // self.chunk_size, y0 // self.chunk_size)
+            return chunk[x0 % self.chunk_size, y0 % self.chunk_size]
+
+        out = np.empty((x1 - x0, y1 - y0), dtype=self.dtype, order="F")
+        if out.size:
+            for chunk_x, chunk_y, chunk_xs, chunk_ys, out_xs, out_ys in self._overlapping_chunks((x0, x1), (y0, y1)):
+                out[out_xs, out_ys] = self.chunk(chunk_x, chunk_y)[chunk_xs, chunk_ys]
+        return out
+
+    def __setitem__(self, key: Any, value: Any) -> None:
+        (x0, x1), (y0, y1), scalar = self._normalize(key)
+        if (x0, x1, y0, y1) == (0, self.shape[0], 0, self.shape[1]) and not self.generate_chunk and np.all(
+                value == self.fill_value):
+            # Clearing the whole store (e.g. visible[:] = False) shouldn't have to touch every chunk.
+            self.reset()
+            return
+
+        value = np.asarray(value, dtype=self.dtype)
+        if value.ndim:
+            value = np.broadcast_to(value, (x1 - x0, y1 - y0))
+        for chunk_x, chunk_y, chunk_xs, chunk_ys, value_xs, value_ys in self._overlapping_chunks((x0, x1), (y0, y1)):
+            chunk = self.chunk(chunk_x, chunk_y)
+            chunk[chunk_xs, chunk_ys] = value[value_xs, value_ys] if value.ndim else value
+
+
+class ChunkedGameMap(GameMap):
+    """
+    A GameMap whose tile, visibility and entity index layers are ChunkStores instead of dense arrays.
+
+    The tile chunks are filled in by a procgen hook the first time they are read, which happens as the viewport, FOV
+    and pathfinding windows reach them. Memory use follows the area the player has been around, not the world size.
+    If spill_dir is given, chunks that haven't been used in a while are moved out to memmapped files in it.
+
+    generate_chunk is called as generate_chunk(game_map, chunk_x, chunk_y, tiles) and may also spawn entities.
+    """
+
+    def __init__(
+            self, engine: Engine, map_width: int, map_height: int, view_width: int, view_height: int,
+            entities: Iterable[Entity] = (),
+            use_entity_store: bool = False,
+            *,
+            generate_chunk: Optional[Callable[[ChunkedGameMap, int, int, np.ndarray], None]] = None,
+            chunk_size: int = 64,
+            max_hot_chunks: int = 256,
+            spill_dir: Optional[str] = None,
+            path_margin: int = 32,
+    ):
+        # These need to be set before GameMap.__init__ creates the layers.
+        self.generate_chunk = generate_chunk
+        self.chunk_size = chunk_size
+        self.max_hot_chunks = max_hot_chunks
+        self.spill_dir = spill_dir
+        self.path_margin = path_margin
+        super().__init__(engine, map_width, map_height, view_width, view_height, entities, use_entity_store)
+
+    def new_layer(self, name: str, fill_value: Any, dtype: Any = None) -> ChunkStore:
+        hook: Optional[ChunkHook] = None
+        if name == "map_tiles" and self.generate_chunk:
+            def hook(chunk_x: int, chunk_y: int, chunk: np.ndarray) -> None:
+                self.generate_chunk(self, chunk_x, chunk_y, chunk)
+
+        return ChunkStore(
+            (self.map_width, self.map_height),
+            dtype=np.asarray(fill_value).dtype if dtype is None else dtype,
+            fill_value=fill_value,
+            chunk_size=self.chunk_size,
+            generate_chunk=hook,
+            max_hot_chunks=self.max_hot_chunks,
+            spill_path=os.path.join(self.spill_dir, f"{name}.chunks") if self.spill_dir else None,
+        )
+
+    def path_window(self, x_a: int, y_a: int, x_b: int, y_b: int) -> Tuple[int, int, int, int]:
+        """Pathfind in the box around both points plus a margin, instead of across the whole world."""
+        return (
+            max(0, min(x_a, x_b) - self.path_margin),
+            max(0, min(y_a, y_b) - self.path_margin),
+            min(self.map_width, max(x_a, x_b) + self.path_margin + 1),
+            min(self.map_height, max(y_a, y_b) + self.path_margin + 1),
+        )
+
+    def close(self) -> None:
+        """Delete the layers' spill files. The map can't be used after this."""
+        for layer in (self.map_tiles, self.visible, self.explored, self.entity_ids):
+            layer.close()
@@ -1,57 +1,195 @@
 from __future__ import annotations
 
-from typing import List, Tuple, TYPE_CHECKING
+from collections import deque
+from typing import Deque, List, Optional, Tuple, TYPE_CHECKING
 
 import numpy as np  # type: ignore
 import tcod
 
 from actions import Action, MeleeAction, MovementAction, WaitAction
 from components.base_component import BaseComponent
+import tile_types
 
 if TYPE_CHECKING:
+    from engine import Engine
     from entity import Actor
+    from game_map import GameMap
+
+# How far along a blocked path repair_path looks for a tile to rejoin it at, and how much room it gives itself.
+REPAIR_LOOKAHEAD = 6
+REPAIR_MARGIN = 3
+
+
+def path_cost(game_map: GameMap, x0: int, y0: int, x1: int, y1: int) -> np.ndarray:
+    """Return the pathfinding cost array for this area of the map."""
+    # Copy the walkable array.
+    cost = np.array(tile_types.WALKABLE[game_map.map_tiles[x0:x1, y0:y1]], dtype=np.int8)
+
+    # Add to the cost of every position with a blocking entity on it (unless the cost is zero, which is blocking).
+    # A lower number means mre enemies will crowd behind each other in
+    # hallways. A higher number means enemies will take longer paths in
+    # order to surround the player.
+    cost[(game_map.entity_ids[x0:x1, y0:y1] >= 0) & (cost > 0)] += 10
+    return cost
+
+
+def find_path(
+        cost: np.ndarray, x0: int, y0: int, start: Tuple[int, int], goal: Tuple[int, int],
+) -> List[Tuple[int, int]]:
+    """
+    Return the path from start to goal (not including start) over a cost array whose [0, 0] is map position (x0, y0),
+    or an empty list if there's no path. This doesn't touch any game state, so it's safe to call from other threads.
+    """
+    # Create a graph from the cost array and pass that graph to a new pathfinder.
+    graph = tcod.path.SimpleGraph(cost=cost, cardinal=2, diagonal=3)
+    pathfinder = tcod.path.Pathfinder(graph)
+
+    pathfinder.add_root((start[0] - x0, start[1] - y0))  # Start position.
+
+    # Compute the path to the destination and remove the starting point.
+    path: List[List[int]] = pathfinder.path_to((goal[0] - x0, goal[1] - y0))[1:].tolist()
+
+    # Convert from List[List[int]] to List[Tuple[int, int]], back in map coordinates.
+    return [(index[0] + x0, index[1] + y0) for index in path]
 
 
 class BaseAI(Action, BaseComponent):
+    __slots__ = ("path", "path_goal")
+
     entity: Actor
 
+    def __init__(self, entity: Actor):
+        super().__init__(entity)
+        # Cached path toward path_goal, next position first. Kept between turns by step_toward.
+        self.path: Deque[Tuple[int, int]] = deque()
+        self.path_goal: Optional[Tuple[int, int]] = None
+
     def perform(self) -> None:
         raise NotImplementedError()
 
-    def get_path_to(self, dest_x: int, dest_y: int) -> List[Tuple[int, int]]:
-        """Compute and return a path to the target position.
+    def clear_path(self) -> None:
+        self.path.clear()
+        self.path_goal = None
 
-        If there is no valid path then returns an empty list.
+    def _is_blocked(self, x: int, y: int) -> bool:
+        game_map = self.entity.game_map
+        return (
+            not tile_types.WALKABLE[game_map.map_tiles[x, y]]
+            or game_map.get_blocking_entity_at_location(x, y) is not None
+        )
+
+    def step_toward(self, goal_x: int, goal_y: int) -> Optional[Tuple[int, int]]:
+        """
+        Return the next position to move to on the way to the goal, or None if there's no way there (or we're there).
+
+        The path is cached between calls and only checked each turn: if the goal moved a single step the path is
+        extended, and if a blocking entity stepped onto the path it's routed around locally with repair_path. Only if
+        that fails, or the path no longer starts next to us, is it recomputed with get_path_to. The position isn't
+        taken off the path until we're actually standing on it, so a failed move (or a bump attack) just tries again.
+        The goal itself is returned even if something is standing on it, so the caller can decide whether to attack it.
+        """
+        if self.update_path(goal_x, goal_y):
+            self.path = deque(self.get_path_to(goal_x, goal_y))
+        return self._next_step()
+
+    def update_path(self, goal_x: int, goal_y: int) -> bool:
+        """
+        Bring the cached path up to date for this goal, as far as that can be done without pathfinding. Returns True
+        if it needs recomputing. Calling this again straight away does nothing, which is what lets the path service
+        call it ahead of the turn.
         """
-        # Copy the walkable array.
-        cost = np.array(self.entity.game_map.map_tiles["walkable"], dtype=np.int8)
+        x, y = self.entity.map_x, self.entity.map_y
+        goal = goal_x, goal_y
+        path = self.path
+        while path and path[0] == (x, y):
+            path.popleft()
 
-        for entity in self.entity.game_map.entities:
-            # Check that an entity blocks movement and the cost isn't zero (blocking.).
-            if entity.blocks_movement and cost[entity.map_x, entity.map_y]:
-                # Add to the cost of a block position.
-                # A lower number means mre enemies will crowd behind each other in
-                # hallways. A higher number means enemies will take longer paths in
-                # order to surround the player.
-                cost[entity.map_x, entity.map_y] += 10
+        if goal != self.path_goal:
+            old_goal = self.path_goal
+            self.path_goal = goal
+            if path and old_goal is not None and path[-1] == old_goal:
+                if len(path) >= 2 and path[-2] == goal:
+                    path.pop()  # The goal stepped back onto the path.
+                    return False
+                if (
+                        max(abs(goal_x - old_goal[0]), abs(goal_y - old_goal[1])) == 1
+                        and tile_types.WALKABLE[self.entity.game_map.map_tiles[goal_x, goal_y]]
+                ):
+                    path.append(goal)  # The goal moved one step, so just follow it.
+                    return False
+            return True
+        # Same goal: only recompute if we got moved off the path somehow.
+        return bool(path) and max(abs(path[0][0] - x), abs(path[0][1] - y)) != 1
 
-        # Create a graph from the cost array and pass that graph to a new pathfinder.
-        graph = tcod.path.SimpleGraph(cost=cost, cardinal=2, diagonal=3)
-        pathfinder = tcod.path.Pathfinder(graph)
+    def path_request(self) -> Optional[Tuple[int, int]]:
+        """The goal this AI will call step_toward with on its next turn, if it can tell in advance."""
+        return None
 
-        pathfinder.add_root((self.entity.map_x, self.entity.map_y))  # Start position.
+    def _next_step(self) -> Optional[Tuple[int, int]]:
+        path = self.path
+        if not path:
+            return None
+        if path[0] != self.path_goal and self._is_blocked(*path[0]) and not self.repair_path():
+            self.path = deque(self.get_path_to(*self.path_goal))
+            if not self.path:
+                return None
+        return self.path[0]
 
-        # Compute the path to the destination and remove the starting point.
-        path: List[List[int]] = pathfinder.path_to((dest_x, dest_y))[1:].tolist()
+    def repair_path(self) -> bool:
+        """
+        Route around whatever blocks the start of the path, by pathfinding in a small box to the first free position
+        in the next REPAIR_LOOKAHEAD steps and splicing that in. Returns False if there's no such detour.
+        """
+        game_map = self.entity.game_map
+        game_map.engine.profiler.count_path_call(type(self).__name__)
+        path = self.path
+        x, y = self.entity.map_x, self.entity.map_y
+
+        for rejoin in range(1, min(REPAIR_LOOKAHEAD, len(path))):
+            if path[rejoin] == self.path_goal or not self._is_blocked(*path[rejoin]):
+                break
+        else:
+            return False
+        rejoin_x, rejoin_y = path[rejoin]
+
+        x0 = max(0, min(x, rejoin_x) - REPAIR_MARGIN)
+        y0 = max(0, min(y, rejoin_y) - REPAIR_MARGIN)
+        x1 = min(game_map.map_width, max(x, rejoin_x) + REPAIR_MARGIN + 1)
+        y1 = min(game_map.map_height, max(y, rejoin_y) + REPAIR_MARGIN + 1)
+        cost = np.array(tile_types.WALKABLE[game_map.map_tiles[x0:x1, y0:y1]], dtype=np.int8)
+        cost[game_map.entity_ids[x0:x1, y0:y1] >= 0] = 0  # Go around other entities this time, not through them.
+        cost[rejoin_x - x0, rejoin_y - y0] = 1  # Except at the rejoin point, if it's the goal.
+
+        pathfinder = tcod.path.Pathfinder(tcod.path.SimpleGraph(cost=cost, cardinal=2, diagonal=3))
+        pathfinder.add_root((x - x0, y - y0))
+        detour: List[List[int]] = pathfinder.path_to((rejoin_x - x0, rejoin_y - y0))[1:].tolist()
+        if not detour:
+            return False
+
+        for _ in range(rejoin + 1):
+            path.popleft()
+        path.extendleft((step_x + x0, step_y + y0) for step_x, step_y in reversed(detour))
+        return True
 
-        # Convert from List[List[int]] to List[Tuple[int, int]].
-        return [(index[0], index[1]) for index in path]
+    def get_path_to(self, dest_x: int, dest_y: int) -> List[Tuple[int, int]]:
+        """Compute and return a path to the target position.
+
+        If there is no valid path then returns an empty list.
+        """
+        game_map = self.entity.game_map
+        game_map.engine.profiler.count_path_call(type(self).__name__)
+        # Only the part of the map the path can reasonably use (the whole map, unless it's a chunked world).
+        x0, y0, x1, y1 = game_map.path_window(self.entity.map_x, self.entity.map_y, dest_x, dest_y)
+        cost = path_cost(game_map, x0, y0, x1, y1)
+        return find_path(cost, x0, y0, (self.entity.map_x, self.entity.map_y), (dest_x, dest_y))
 
 
 class HostileEnemy(BaseAI):
+    __slots__ = ("last_seen",)
+
     def __init__(self, entity: Actor):
         super().__init__(entity)  #TODO: Look into correct way to use super()
-        self.path: List[Tuple[int, int]] = []
+        self.last_seen: Optional[Tuple[int, int]] = None  # Where the player was when this enemy last saw them.
 
     def perform(self) -> None:
         target = self.engine.player
@@ -63,12 +201,102 @@ class HostileEnemy(BaseAI):
             if distance <= 1:
                 return MeleeAction(self.entity, dx, dy).perform()
 
-            self.path = self.get_path_to(target.map_x, target.map_y)
+            # While the player is in sight, walk downhill on the engine's shared flow field.
+            self.start_chase(target.map_x, target.map_y)
+            step = self.engine.flow_field_step(self.entity.map_x, self.entity.map_y)
+            if step:
+                return MovementAction(self.entity, *step).perform()
+            return WaitAction(self.entity).perform()
 
-        if self.path:
-            dest_x, dest_y = self.path.pop(0)
-            return MovementAction(
-                self.entity, dest_x - self.entity.map_x, dest_y - self.entity.map_y,
-            ).perform()
+        if self.last_seen:
+            # Lost sight of the player, so head for where they were last seen.
+            step = self.step_toward(*self.last_seen)
+            if step and not (step == self.last_seen and self._is_blocked(*step)):
+                return MovementAction(
+                    self.entity, step[0] - self.entity.map_x, step[1] - self.entity.map_y,
+                ).perform()
+            # Got there, can't get there, or someone else is standing there. Either way there's no sign of the player.
+            self.last_seen = None
+            self.clear_path()
 
         return WaitAction(self.entity).perform()
+
+    def path_request(self) -> Optional[Tuple[int, int]]:
+        if self.last_seen and not self.engine.game_map.visible[self.entity.map_x, self.entity.map_y]:
+            return self.last_seen
+        return None
+
+    def start_chase(self, target_x: int, target_y: int) -> None:
+        """The player is in sight: remember where, and drop any old path since the flow field takes over."""
+        self.last_seen = target_x, target_y
+        self.clear_path()
+
+
+def perform_hostile_turns(engine: Engine, enemies: List[Actor]) -> None:
+    """
+    Play out HostileEnemy.perform() for each of these enemies in order, with the same results, but in groups.
+
+    Visibility and distance to the player are worked out for every enemy at once. Enemies next to the player attack
+    in one batch with a single hp change, enemies that can see the player take their step from one vectorized pass
+    over the flow field, and out of sight enemies with nowhere to go are skipped. Moves are still made one at a time
+    in order, so the first enemy to claim a tile gets it.
+    """
+    if not enemies:
+        return
+    game_map = engine.game_map
+    target = engine.player
+    store = game_map.entity_store
+    if store is not None:
+        rows = store.rows_of(enemies)
+        xs, ys = store.x[rows].astype(np.int64), store.y[rows].astype(np.int64)
+    else:
+        xs = np.fromiter((enemy.map_x for enemy in enemies), dtype=np.int64, count=len(enemies))
+        ys = np.fromiter((enemy.map_y for enemy in enemies), dtype=np.int64, count=len(enemies))
+    distance = np.maximum(abs(target.map_x - xs), abs(target.map_y - ys))  # Chebyshev distance.
+
+    # Nothing outside of the last FOV window is visible, so that's the only part of the map that needs reading.
+    x0, y0, x1, y1 = engine.fov_window
+    in_window = (x0 <= xs) & (xs < x1) & (y0 <= ys) & (ys < y1)
+    visible = np.zeros(len(enemies), dtype=bool)
+    visible[in_window] = game_map.visible[x0:x1, y0:y1][xs[in_window] - x0, ys[in_window] - y0]
+
+    attacking = visible & (distance <= 1)
+    chasing = visible & (distance > 1)
+
+    attackers = [enemies[index] for index in np.flatnonzero(attacking).tolist()]
+    if attackers:
+        if store is not None:
+            damage = store.power[rows[attacking]].astype(np.int64)
+        else:
+            damage = np.fromiter((enemy.fighter.power for enemy in attackers), dtype=np.int64, count=len(attackers))
+        damage -= target.fighter.defense
+        if not target.is_alive or damage.clip(min=0).sum() >= target.fighter.hp:
+            # The player dies partway through the attacks, which changes what the enemies after that see.
+            # That's rare, so just play this turn out one enemy at a time.
+            for enemy in enemies:
+                enemy.ai.perform()
+            return
+        for attacker, attacker_damage in zip(attackers, damage.tolist()):
+            MeleeAction.report(attacker, target, attacker_damage)
+        target.fighter.hp -= int(damage.clip(min=0).sum())
+
+    steps: Optional[List[List[int]]] = None
+    for index in np.flatnonzero(~attacking).tolist():
+        enemy = enemies[index]
+        ai: HostileEnemy = enemy.ai
+        if chasing[index]:
+            ai.start_chase(target.map_x, target.map_y)
+            if steps is None:
+                # Enemies before this one may have moved, so the flow field is only built now, like in perform().
+                steps = engine.flow_field_steps(xs, ys).tolist()
+            dx, dy = steps[index]
+            dest_x, dest_y = xs[index] + dx, ys[index] + dy
+            if (
+                    (dx or dy)
+                    and tile_types.WALKABLE[game_map.map_tiles[dest_x, dest_y]]
+                    and game_map.get_blocking_entity_at_location(dest_x, dest_y) is None
+            ):
+                enemy.move(dx, dy)
+        elif ai.last_seen:
+            ai.perform()  # Out of sight and following a path, which is per enemy anyway.
+        # Anyone else would just wait.
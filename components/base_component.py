@@ -8,6 +8,8 @@ if TYPE_CHECKING:
 
 
 class BaseComponent:
+    __slots__ = ()  # Subclasses declare their own slots, including "entity".
+
     entity: Entity  # Owning entity instance.
 
     @property
@@ -11,6 +11,8 @@ if TYPE_CHECKING:
 
 
 class Fighter(BaseComponent):
+    __slots__ = ("entity", "max_hp", "_hp", "defense", "power")
+
     entity: Actor
 
     def __init__(self, hp: int, defense: int, power: int):
@@ -19,6 +21,12 @@ class Fighter(BaseComponent):
         self.defense = defense
         self.power = power
 
+    def clone(self) -> Fighter:
+        """Return a copy of this component that isn't attached to an entity yet."""
+        clone = Fighter(hp=self.max_hp, defense=self.defense, power=self.power)
+        clone._hp = self._hp
+        return clone
+
     @property
     def hp(self) -> int:
         return self._hp
@@ -26,15 +34,18 @@ class Fighter(BaseComponent):
     @hp.setter
     def hp(self, value: int) -> None:
         self._hp = max(0, min(value, self.max_hp))
+        if hasattr(self.entity, "game_map"):
+            self.entity.game_map.update_entity_stats(self.entity)
         if self._hp == 0 and self.entity.ai:
             self.die()
 
     def die(self) -> None:
         if self.engine.player is self.entity:
-            death_message = "You died!"
+            kind = "player_death"
             self.engine.event_handler = GameOverEventHandler(self.engine)
         else:
-            death_message = f"{self.entity.name} is dead!"
+            kind = "death"
+        self.engine.message_log.add(self.engine.turn, kind, self.entity.name)
 
         self.entity.char = "%"
         self.entity.color = (191, 0, 0)
@@ -42,5 +53,4 @@ class Fighter(BaseComponent):
         self.entity.ai = None
         self.entity.name = f"remains of {self.entity.name}"
         self.entity.render_order = RenderOrder.CORPSE
-
-        print(death_message)
+        self.entity.game_map.reindex_entity(self.entity)
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Generates a corpus of seeded dungeons across all cores, for tuning the procgen parameters.
+
+Every combination of the given parameter values gets --count maps. The maps and their spawns are saved to a
+compressed .npz file together with per-map statistics (floor ratio, room count, connectivity and monster density),
+and a summary of the statistics for each parameter combination is printed. Example:
+
+    python dungeon_corpus.py --count 1000 --max-rooms 20 30 40 --max-monsters-per-room 1 2 3 --output corpus.npz
+"""
+from __future__ import annotations
+
+import argparse
+import itertools
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Tuple
+
+import numpy as np  # type: ignore
+import tcod.path
+
+from level_pipeline import LevelSpec, generate_level
+import tile_types
+
+STAT_NAMES = ["floor_ratio", "room_count", "connectivity", "monster_count", "monster_density"]
+
+
+def level_stats(spec: LevelSpec) -> Dict[str, float]:
+    """Compute the corpus statistics for one generated level."""
+    walkable = tile_types.WALKABLE[spec.map_tiles]
+    floor = int(walkable.sum())
+
+    # Connectivity is the fraction of the floor the player can actually walk to from the start position.
+    distance = tcod.path.maxarray(walkable.shape, dtype=np.int32, order="F")
+    distance[spec.player_x, spec.player_y] = 0
+    tcod.path.dijkstra2d(distance, walkable.astype(np.int32), 1, 1)
+    reachable = int((distance != np.iinfo(np.int32).max).sum())
+
+    return {
+        "floor_ratio": floor / walkable.size,
+        "room_count": len(spec.rooms),
+        "connectivity": reachable / max(floor, 1),
+        "monster_count": len(spec.spawns),
+        "monster_density": len(spec.spawns) / max(floor, 1),
+    }
+
+
+def map_seed(base_seed: int, params: Dict[str, Any], index: int) -> int:
+    """
+    Seed of the index-th map of a parameter combination. The parameter values go into it, so every combination gets
+    maps of its own instead of every combination reusing the same seeds, and a combination gets the same maps
+    whichever other values it's run alongside.
+    """
+    settings = ",".join(f"{name}={params[name]}" for name in sorted(params))
+    return random.Random(f"{base_seed}:{settings}:{index}").getrandbits(32)
+
+
+def generate_entry(job: Tuple[int, Dict[str, Any]]) -> Tuple[LevelSpec, Dict[str, float]]:
+    """Worker function: generate one level and its statistics."""
+    seed, params = job
+    spec = generate_level(seed, params)
+    return spec, level_stats(spec)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=100, help="Maps per parameter combination.")
+    parser.add_argument(
+        "--seed", type=int, default=0, help="Base seed; map seeds are derived from it and each combination.",
+    )
+    parser.add_argument("--output", default="corpus.npz")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: one per core).")
+    parser.add_argument("--map-width", type=int, default=80)
+    parser.add_argument("--map-height", type=int, default=45)
+    parser.add_argument("--room-min-size", type=int, nargs="+", default=[6])
+    parser.add_argument("--room-max-size", type=int, nargs="+", default=[10])
+    parser.add_argument("--max-rooms", type=int, nargs="+", default=[30])
+    parser.add_argument("--max-monsters-per-room", type=int, nargs="+", default=[2])
+    args = parser.parse_args()
+
+    combinations: List[Dict[str, Any]] = [
+        dict(
+            max_rooms=max_rooms,
+            room_min_size=room_min_size,
+            room_max_size=room_max_size,
+            map_width=args.map_width,
+            map_height=args.map_height,
+            view_width=80,
+            view_height=45,
+            max_monsters_per_room=max_monsters_per_room,
+        )
+        for room_min_size, room_max_size, max_rooms, max_monsters_per_room in itertools.product(
+            args.room_min_size, args.room_max_size, args.max_rooms, args.max_monsters_per_room
+        )
+        if room_min_size <= room_max_size
+    ]
+    if not combinations:
+        parser.error("every --room-min-size is larger than every --room-max-size, so there's nothing to generate")
+    if args.count < 1:
+        parser.error("--count must be at least 1")
+    jobs = [
+        (map_seed(args.seed, params, index), params)
+        for params in combinations
+        for index in range(args.count)
+    ]
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        results = list(executor.map(generate_entry, jobs, chunksize=max(1, len(jobs) // 256)))
+    elapsed = time.perf_counter() - start
+
+    specs = [spec for spec, _ in results]
+    stats = {name: np.array([entry[name] for _, entry in results]) for name in STAT_NAMES}
+    # Spawns and rooms differ in length per map, so they're concatenated with an offset table into them.
+    spawn_offsets = np.cumsum([0] + [len(spec.spawns) for spec in specs])
+    room_offsets = np.cumsum([0] + [len(spec.rooms) for spec in specs])
+    np.savez_compressed(
+        args.output,
+        map_tiles=np.stack([spec.map_tiles for spec in specs]),
+        seeds=np.array([spec.seed for spec in specs], dtype=np.uint32),
+        player_start=np.array([(spec.player_x, spec.player_y) for spec in specs], dtype=np.int32).reshape(-1, 2),
+        spawns=np.concatenate([spec.spawns for spec in specs]),
+        spawn_offsets=spawn_offsets,
+        rooms=np.concatenate([spec.rooms for spec in specs]),
+        room_offsets=room_offsets,
+        **{name: np.array([params[name] for _, params in jobs]) for name in combinations[0]},
+        **stats,
+    )
+
+    print(
+        f"Generated {len(jobs)} maps in {elapsed:.2f}s ({len(jobs) / max(elapsed, 1e-9):.1f} maps/s) -> {args.output}"
+    )
+    print(f"{'min':>4} {'max':>4} {'rooms':>5} {'mon':>4} | " + " ".join(f"{name:>15}" for name in STAT_NAMES))
+    for index, params in enumerate(combinations):
+        selected = slice(index * args.count, (index + 1) * args.count)
+        print(
+            f"{params['room_min_size']:>4} {params['room_max_size']:>4} {params['max_rooms']:>5} "
+            f"{params['max_monsters_per_room']:>4} | "
+            + " ".join(f"{stats[name][selected].mean():>15.4f}" for name in STAT_NAMES)
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,42 +1,206 @@
 from __future__ import annotations
 
-from typing import TYPE_CHECKING
+from typing import List, Optional, Tuple, TYPE_CHECKING
 
+import numpy as np  # type: ignore
 from tcod.context import Context
 from tcod.console import Console
 from tcod.map import compute_fov
+import tcod.path
 
+from components.ai import HostileEnemy, perform_hostile_turns
 from input_handlers import MainGameEventHandler
+from message_log import MessageLog
+from path_service import PathService
+import tile_types
+from turn_profiler import TurnProfiler
+from turn_scheduler import TurnScheduler
 
 if TYPE_CHECKING:
-    from entity import Entity
+    from entity import Actor
     from game_map import GameMap
     from input_handlers import EventHandler
+    from replay import ReplayRecorder
+    from save_game import Autosaver
+
+# The eight neighbouring steps checked when walking downhill on the flow field.
+FLOW_FIELD_STEPS = ((0, -1), (0, 1), (-1, 0), (1, 0), (-1, -1), (1, -1), (-1, 1), (1, 1))
 
 
 class Engine:
     game_map: GameMap
 
-    def __init__(self, player: Entity):
+    def __init__(self, player: Actor):
         self.event_handler: EventHandler = MainGameEventHandler(self)
         self.player = player
+        self.message_log = MessageLog()
+        self.turn = 0  # Number of completed turns, used to stamp messages.
+        self.profiler = TurnProfiler()  # Off until toggled from the keyboard.
+        self.autosaver: Optional[Autosaver] = None
+        self.recorder: Optional[ReplayRecorder] = None  # Set to log every player action for replay.py.
+        # Set whenever something visible changes, so the frame loop knows there's something new to present.
+        self.needs_render = True
+
+        """
+        Shared flow field (Dijkstra map) rooted at the player. Enemies only chase the player while they can see them,
+        so the field only has to cover a window around the player that is comfortably bigger than the FOV radius.
+        flow_field_origin is the map coordinate of flow_field[0, 0].
+        """
+        self.flow_field_radius = 24
+        self.flow_field: Optional[np.ndarray] = None
+        self.flow_field_origin = (0, 0)
+
+        # Resolve the enemy phase with perform_hostile_turns instead of one AI.perform() call per enemy. Below
+        # batch_min_enemies awake enemies the numpy overhead costs more than it saves, so small rounds run one by one.
+        self.batch_enemy_turns = True
+        self.batch_min_enemies = 48
+        # Decides who acts each turn, and lets far away idle enemies sleep.
+        self.scheduler = TurnScheduler(self)
+        # Solves the paths a round of enemies needs up front, in parallel. None to pathfind as each enemy acts.
+        self.path_service: Optional[PathService] = PathService(self)
+
+        # State of the last FOV computation, used by update_fov to skip or limit its work.
+        self.fov_radius = 8
+        self._fov_map: Optional[GameMap] = None
+        self._fov_origin: Optional[Tuple[int, int]] = None
+        self.fov_window = (0, 0, 0, 0)  # The area update_fov last covered; nothing outside it is visible.
+        self._fov_transparent: Optional[np.ndarray] = None
 
     def handle_enemy_turns(self) -> None:
-        for entity in set(self.game_map.actors) - {self.player}:
-            if entity.ai:
-                entity.ai.perform()
+        self.scheduler.run_turn()
+
+    def perform_enemy_round(self, enemies: List[Actor]) -> None:
+        """
+        Let these enemies act, in this order. The scheduler hands them over sorted by entity id, so a turn always
+        plays out the same way.
+        """
+        self.flow_field = None  # Recomputed by the first enemy that needs it this round.
+        if self.path_service is not None:
+            self.path_service.prepare_round(enemies)
+        if (
+                self.batch_enemy_turns
+                and len(enemies) >= self.batch_min_enemies
+                and all(type(enemy.ai) is HostileEnemy for enemy in enemies)
+        ):
+            return perform_hostile_turns(self, enemies)
+
+        for entity in enemies:
+            entity.ai.perform()
+
+    def update_flow_field(self) -> None:
+        """Recompute the distance map toward the player, with crowd costs for blocking entities applied once."""
+        game_map = self.game_map
+        x0 = max(0, self.player.map_x - self.flow_field_radius)
+        y0 = max(0, self.player.map_y - self.flow_field_radius)
+        x1 = min(game_map.map_width, self.player.map_x + self.flow_field_radius + 1)
+        y1 = min(game_map.map_height, self.player.map_y + self.flow_field_radius + 1)
+
+        cost = np.array(tile_types.WALKABLE[game_map.map_tiles[x0:x1, y0:y1]], dtype=np.int32)
+        # Same crowding cost as BaseAI.get_path_to, so enemies spread out instead of queueing in corridors.
+        cost[(game_map.entity_ids[x0:x1, y0:y1] >= 0) & (cost > 0)] += 10
+
+        distance = tcod.path.maxarray((x1 - x0, y1 - y0), dtype=np.int32, order="F")
+        distance[self.player.map_x - x0, self.player.map_y - y0] = 0
+        tcod.path.dijkstra2d(distance, cost, 2, 3)
+
+        self.flow_field = distance
+        self.flow_field_origin = (x0, y0)
+
+    def flow_field_step(self, x: int, y: int) -> Optional[Tuple[int, int]]:
+        """
+        Return the (dx, dy) step that goes downhill on the flow field from this position.
+
+        Returns None if the position is outside of the field or no neighbour is closer to the player.
+        """
+        if self.flow_field is None:
+            self.update_flow_field()
+        field_x = x - self.flow_field_origin[0]
+        field_y = y - self.flow_field_origin[1]
+        width, height = self.flow_field.shape
+        if not (0 <= field_x < width and 0 <= field_y < height):
+            return None
+
+        best_step = None
+        best_distance = self.flow_field[field_x, field_y]
+        for dx, dy in FLOW_FIELD_STEPS:
+            next_x, next_y = field_x + dx, field_y + dy
+            if 0 <= next_x < width and 0 <= next_y < height and self.flow_field[next_x, next_y] < best_distance:
+                best_step = dx, dy
+                best_distance = self.flow_field[next_x, next_y]
+
+        return best_step
+
+    def flow_field_steps(self, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+        """
+        flow_field_step for many positions at once. Returns one (dx, dy) row per position, with (0, 0) wherever
+        flow_field_step would return None.
+        """
+        if self.flow_field is None:
+            self.update_flow_field()
+        width, height = self.flow_field.shape
+        field_x = xs - self.flow_field_origin[0]
+        field_y = ys - self.flow_field_origin[1]
+        in_field = (0 <= field_x) & (field_x < width) & (0 <= field_y) & (field_y < height)
+
+        # Surround the field with a border that's further than anything, so neighbours never need bounds checks.
+        padded = np.full((width + 2, height + 2), np.iinfo(np.int64).max, dtype=np.int64)
+        padded[1:-1, 1:-1] = self.flow_field
+        padded_x = np.clip(field_x, 0, width - 1) + 1
+        padded_y = np.clip(field_y, 0, height - 1) + 1
+
+        neighbours = np.stack([padded[padded_x + dx, padded_y + dy] for dx, dy in FLOW_FIELD_STEPS])
+        # argmin picks the first of equally close neighbours, the same tie break as flow_field_step.
+        best = neighbours.argmin(axis=0)
+        downhill = in_field & (neighbours[best, np.arange(len(best))] < padded[padded_x, padded_y])
+
+        steps = np.array(FLOW_FIELD_STEPS)[best]
+        steps[~downhill] = 0
+        return steps
+
+    def invalidate_fov(self) -> None:
+        """Make the next update_fov() recompute the FOV even if nothing changed, e.g. to time it."""
+        self._fov_origin = None
 
     def update_fov(self) -> None:
-        """Recompute the visible area based on the player's point of view."""
-        self.game_map.visible[:] = compute_fov(
-            self.game_map.map_tiles["transparent"],
-            (self.player.map_x, self.player.map_y),
-            radius=8
-        )
+        """
+        Recompute the visible area based on the player's point of view.
+
+        Only the window around the player that the FOV radius can reach is computed, and nothing is done at all if
+        the player hasn't moved and none of the tiles in that window changed transparency (e.g. after a WaitAction).
+        """
+        game_map = self.game_map
+        x, y = self.player.map_x, self.player.map_y
+        x0 = max(0, x - self.fov_radius)
+        y0 = max(0, y - self.fov_radius)
+        x1 = min(game_map.map_width, x + self.fov_radius + 1)
+        y1 = min(game_map.map_height, y + self.fov_radius + 1)
+        transparent = tile_types.TRANSPARENT[game_map.map_tiles[x0:x1, y0:y1]]
+
+        same_map = self._fov_map is game_map
+        if same_map and self._fov_origin == (x, y) and np.array_equal(transparent, self._fov_transparent):
+            return
+
+        # Clear what was visible last time. A new map only needs clearing once.
+        if same_map:
+            old_x0, old_y0, old_x1, old_y1 = self.fov_window
+            game_map.visible[old_x0:old_x1, old_y0:old_y1] = False
+        else:
+            game_map.visible[:] = False
+
+        visible = compute_fov(transparent, (x - x0, y - y0), radius=self.fov_radius)
+        game_map.visible[x0:x1, y0:y1] = visible
         # If a tile is "visible" it should be added to "explored".
-        self.game_map.explored |= self.game_map.visible
+        game_map.explored[x0:x1, y0:y1] |= visible
+        game_map.refresh_viewport()
 
-    def render(self, console: Console, context: Context) -> None:
+        self._fov_map = game_map
+        self._fov_origin = (x, y)
+        self.fov_window = (x0, y0, x1, y1)
+        self._fov_transparent = transparent.copy()
+        self.needs_render = True
+
+    def draw(self, console: Console) -> None:
+        """Draw a frame onto the console, without presenting it."""
         self.game_map.render(console)
 
         console.print(
@@ -44,7 +208,17 @@ class Engine:
             y=47,
             string=f"HP: {self.player.fighter.hp}/{self.player.fighter.max_hp}",
         )
+        self.message_log.render(console, x=21, y=45, width=58, height=5)
+        if self.profiler.enabled:
+            # Around the HP line, in the space left of the message log.
+            for y, line in zip((45, 46, 48), self.profiler.overlay_lines()):
+                console.print(x=1, y=y, string=line, fg=(128, 255, 128))
 
-        context.present(console)
+    def render(self, console: Console, context: Context) -> None:
+        with self.profiler.phase("render"):
+            self.draw(console)
+            context.present(console)
+        self.profiler.end_frame()  # After the render time went on the row of the turn this frame shows.
 
         console.clear()
+        self.needs_render = False
@@ -18,6 +18,9 @@ class Entity:
     A generic object to represent players, enemies, items, etc.
     """
 
+    # Slots keep every entity small and quick to build, which matters when thousands of them get spawned.
+    __slots__ = ("game_map", "map_x", "map_y", "char", "color", "name", "blocks_movement", "render_order")
+
     game_map: GameMap
 
     def __init__(
@@ -41,15 +44,27 @@ class Entity:
         if game_map:
             # If game_map isn't provided now then it will be set later.
             self.game_map = game_map
-            game_map.entities.add(self)
+            game_map.add_entity(self)
+
+    def clone(self: T) -> T:
+        """
+        Return a fresh copy of this entity, of the same class, that isn't on any map yet.
+
+        This is meant for the prototypes in entity_factories. It's a shallow copy, which is all an Entity needs since
+        its fields are immutable; subclasses with mutable parts (like Actor's AI and Fighter) override it.
+        """
+        clone = copy.copy(self)
+        if hasattr(clone, "game_map"):
+            del clone.game_map
+        return clone
 
     def spawn(self: T, game_map: GameMap, x: int, y: int) -> T:
         """Spawn a copy of this instance at the give location."""
-        clone = copy.deepcopy(self)
+        clone = self.clone()
         clone.map_x = x
         clone.map_y = y
         clone.game_map = game_map
-        game_map.entities.add(clone)
+        game_map.add_entity(clone)
         return clone
 
     def place(self, x: int, y: int, game_map: Optional[GameMap] = None) -> None:
@@ -58,16 +73,22 @@ class Entity:
         self.map_y = y
         if game_map:
             if hasattr(self, "game_map"):  # Possibly uninitialized.
-                self.game_map.entities.remove(self)
+                self.game_map.remove_entity(self)
             self.game_map = game_map
-            game_map.entities.add(self)
+            game_map.add_entity(self)
+        elif hasattr(self, "game_map"):
+            self.game_map.reindex_entity(self)
 
     def move(self, dx: int, dy: int) -> None:
         # Move the entity by a given amount
         self.map_x += dx
         self.map_y += dy
+        self.game_map.reindex_entity(self)
+
 
 class Actor(Entity):
+    __slots__ = ("ai_cls", "ai", "fighter", "speed")
+
     def __init__(
             self,
             *,
@@ -77,7 +98,8 @@ class Actor(Entity):
             color: Tuple[int, int, int] = (255, 255, 255),
             name: str = "<Unnamed>",
             ai_cls: Type[BaseAI],
-            fighter: Fighter
+            fighter: Fighter,
+            speed: int = 100,
     ):
         super().__init__(
             map_x=x,
@@ -89,11 +111,27 @@ class Actor(Entity):
             render_order=RenderOrder.ACTOR,
         )
 
+        self.ai_cls = ai_cls  # Kept so that clone() can build a new AI even after this one is gone.
         self.ai: Optional[BaseAI] = ai_cls(self)
 
         self.fighter = fighter
         self.fighter.entity = self
 
+        self.speed = speed  # How often this actor gets to act; 100 is once per player turn.
+
+    def clone(self) -> Actor:
+        """Return a fresh copy of this actor, with its own AI and Fighter, that isn't on any map yet."""
+        return Actor(
+            x=self.map_x,
+            y=self.map_y,
+            char=self.char,
+            color=self.color,
+            name=self.name,
+            ai_cls=self.ai_cls,
+            fighter=self.fighter.clone(),
+            speed=self.speed,
+        )
+
     @property
     def is_alive(self) -> bool:
         """Returns True as long as this actor can perform actions."""
@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+from typing import Dict, Iterable, List, Optional, TYPE_CHECKING
+
+import numpy as np  # type: ignore
+
+if TYPE_CHECKING:
+    from entity import Entity
+
+
+class EntityStore:
+    """
+    Struct-of-arrays mirror of the entities on a GameMap.
+
+    Each entity gets a row of its own while it's on the map. Rows of removed entities are handed out again, so the
+    arrays only ever grow to the most entities the map has held at once. GameMap keeps the rows up to date from the
+    same hooks that maintain its position index (add_entity, remove_entity and reindex_entity), and Fighter keeps hp
+    up to date. The Python objects stay the source of truth; the arrays are there so the positions and stats of a group
+    of entities (say the enemies acting this round, or whatever's in the viewport) can be read with one fancy index
+    instead of a loop over the objects. Finding *which* entities are somewhere is GameMap's position index's job.
+    """
+
+    def __init__(self, capacity: int = 256):
+        self.entities: List[Optional[Entity]] = [None] * capacity
+        self._row_of: Dict[Entity, int] = {}
+        self._free: List[int] = []  # Rows given up by removed entities, to be reused first.
+        self.in_use = np.zeros(capacity, dtype=bool)
+        self.x = np.zeros(capacity, dtype=np.int32)
+        self.y = np.zeros(capacity, dtype=np.int32)
+        self.hp = np.zeros(capacity, dtype=np.int32)
+        self.defense = np.zeros(capacity, dtype=np.int32)
+        self.power = np.zeros(capacity, dtype=np.int32)
+        self.render_order = np.zeros(capacity, dtype=np.uint8)
+        self.glyph = np.zeros(capacity, dtype=np.int32)
+        self.color = np.zeros((capacity, 3), dtype=np.uint8)
+        self.blocks = np.zeros(capacity, dtype=bool)
+        self.is_actor = np.zeros(capacity, dtype=bool)
+        self.alive = np.zeros(capacity, dtype=bool)
+
+    @property
+    def capacity(self) -> int:
+        return len(self.entities)
+
+    def _grow(self, minimum: int) -> None:
+        capacity = self.capacity
+        while capacity <= minimum:
+            capacity *= 2
+        self.entities.extend([None] * (capacity - self.capacity))
+        for name in ("in_use", "x", "y", "hp", "defense", "power", "render_order", "glyph", "color", "blocks",
+                     "is_actor", "alive"):
+            old = getattr(self, name)
+            new = np.zeros((capacity, *old.shape[1:]), dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def row(self, entity: Entity) -> int:
+        return self._row_of[entity]
+
+    def rows_of(self, entities: Iterable[Entity]) -> np.ndarray:
+        return np.fromiter((self._row_of[entity] for entity in entities), dtype=np.intp)
+
+    def sync(self, entity: Entity) -> None:
+        """Copy an entity's current state into its row, giving it a row first if it doesn't have one yet."""
+        row = self._row_of.get(entity)
+        if row is None:
+            row = self._free.pop() if self._free else len(self._row_of)
+            if row >= self.capacity:
+                self._grow(row)
+            self._row_of[entity] = row
+        self.entities[row] = entity
+        self.in_use[row] = True
+        self.x[row] = entity.map_x
+        self.y[row] = entity.map_y
+        self.render_order[row] = entity.render_order.value
+        self.glyph[row] = ord(entity.char)
+        self.color[row] = entity.color
+        self.blocks[row] = entity.blocks_movement
+        fighter = getattr(entity, "fighter", None)
+        self.is_actor[row] = fighter is not None
+        self.alive[row] = fighter is not None and entity.is_alive
+        if fighter is not None:
+            self.sync_stats(entity)
+
+    def sync_stats(self, entity: Entity) -> None:
+        """Copy just the combat stats of an actor into its row."""
+        row = self._row_of.get(entity)
+        if row is None:
+            return
+        fighter = entity.fighter
+        self.hp[row] = fighter.hp
+        self.defense[row] = fighter.defense
+        self.power[row] = fighter.power
+
+    def remove(self, entity: Entity) -> None:
+        row = self._row_of.pop(entity, None)
+        if row is None:
+            return
+        self._free.append(row)
+        self.entities[row] = None
+        self.in_use[row] = False
+        self.alive[row] = False
+
+    def rows_where(
+            self, mask: np.ndarray, rows: np.ndarray, x0: int = 0, y0: int = 0, living_actors: bool = False,
+    ) -> np.ndarray:
+        """
+        Return those of `rows` whose entity stands on a True cell of `mask`, where mask[0, 0] is map position (x0, y0).
+        Entities outside of the mask are dropped too. The rows usually come from rows_of() on a GameMap position
+        query, so nothing here scans the whole store.
+
+        With living_actors=True only living actors are returned.
+        """
+        width, height = mask.shape
+        xs, ys = self.x[rows] - x0, self.y[rows] - y0
+        inside = (xs >= 0) & (xs < width) & (ys >= 0) & (ys < height)
+        rows, xs, ys = rows[inside], xs[inside], ys[inside]
+        keep = mask[xs, ys]
+        if living_actors:
+            keep &= self.alive[rows]
+        return rows[keep]
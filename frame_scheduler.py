@@ -0,0 +1,43 @@
+from __future__ import annotations
+
+import time
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from tcod.console import Console
+    from tcod.context import Context
+    from engine import Engine
+
+
+class FrameScheduler:
+    """
+    The main loop. Only renders when the engine says something changed (engine.needs_render), and at most max_fps
+    times a second.
+
+    Input that arrives before the next frame is due is handled straight away, but it all shows up in one present. So
+    a held-down key that repeats faster than the frame rate still moves the player every repeat, without a present
+    for every step. While nothing changes the loop just sleeps in tcod.event.wait.
+    """
+
+    def __init__(self, engine: Engine, console: Console, context: Context, max_fps: float = 60):
+        self.engine = engine
+        self.console = console
+        self.context = context
+        self.frame_time = 1 / max_fps
+        self.frames = 0  # Frames actually presented.
+
+    def run(self) -> None:
+        next_frame = 0.0
+        while True:
+            now = time.perf_counter()
+            if self.engine.needs_render and now >= next_frame:
+                self.engine.render(console=self.console, context=self.context)
+                self.frames += 1
+                next_frame = now + self.frame_time
+
+            if self.engine.needs_render:
+                # Something changed but it's too soon for another frame, so take input until the frame is due.
+                timeout = max(0.0, next_frame - time.perf_counter())
+            else:
+                timeout = None  # Nothing to draw until there's input.
+            self.engine.event_handler.handle_events(timeout)
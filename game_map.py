@@ -1,107 +1,276 @@
 from __future__ import annotations
 
-from typing import Iterable, Optional, TYPE_CHECKING, Iterator
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple, TYPE_CHECKING, Iterator
 
 import numpy as np  # type: ignore
 
 from tcod.console import Console
 
 from entity import Actor
+from entity_store import EntityStore
+from render_order import RenderOrder
 import tile_types
 
 if TYPE_CHECKING:
     from engine import Engine
     from entity import Entity
+    from procgen import RectangularRoom
 
 
 class GameMap:
+    entity_block_size = 16  # Side of the blocks the entities are bucketed by, see _entity_blocks.
+
     def __init__(
             self, engine: Engine, map_width: int, map_height: int, view_width: int, view_height: int,
-            entities: Iterable[Entity] = ()
+            entities: Iterable[Entity] = (), use_entity_store: bool = False,
     ):
         self.engine = engine
-        self.entities = set(entities)
+        self.entities: Set[Entity] = set()
+        self.rooms: List[RectangularRoom] = []  # Filled in by procgen, if the map was built out of rooms.
         """
-        The following buffer code is a temporary implementation to prevent the out-of-bounds viewport errors
-        until I find a more elegant way to fix it. Might be better to implement something in the in_bounds function.
+        The map arrays are exactly map_width x map_height. The viewport is allowed to hang off the edges of the map;
+        update_viewport() pads the parts outside the map so they render as SHROUD.
         """
-        self.buffer_x = int(view_width/2)
-        self.buffer_y = int(view_height/2)
-        # Adding view width and height to map width and height to create the buffer zone of the right size.
-        self.map_width = map_width + view_width
-        self.map_height = map_height + view_height
+        self.map_width = map_width
+        self.map_height = map_height
         self.view_width, self.view_height = view_width, view_height
         # Initialize the viewport at the center of the map. This will be overridden later.
         self.viewport_origin_x = int(map_width / 2 - self.view_width / 2)
         self.viewport_origin_y = int(map_height / 2 - self.view_height / 2 + 1)
         # ^The +1 is sort of a hack fix for issues that arise from the division when defining the viewport origin based
         # on the player position.
-        self.map_tiles = np.full((self.map_width, self.map_height), fill_value=tile_types.wall, order="F")
+        self.map_tiles = self.new_layer("map_tiles", tile_types.wall, dtype=tile_types.tile_id_dt)  # Tile ids.
+
+        self.visible = self.new_layer("visible", False)  # Tiles the player can currently see
 
-        #  Current viewport implementation. Keep in mind that this is a "view" and not a "copy" of the tiles array:
-        self.viewport_tiles = self.map_tiles[self.viewport_origin_x:self.viewport_origin_x + self.view_width,
-                                             self.viewport_origin_y:self.viewport_origin_y + self.view_height]
+        self.explored = self.new_layer("explored", False)  # Tiles the player has seen before
 
-        self.visible = np.full(
-            (self.map_width, self.map_height), fill_value=False, order="F"
-        )  # Tiles the player can currently see
+        """
+        Position index so that location lookups don't have to scan every entity. entity_ids holds the id of the
+        blocking entity standing on each tile (or -1 for a free tile), and living_actors is a registry of the actors
+        that are still alive. Both are kept in sync by reindex_entity(), which Entity.place/move/spawn and Fighter.die
+        call whenever an entity's position or state changes.
+        """
+        self.entity_ids = self.new_layer("entity_ids", -1, dtype=np.int32)
+        self.living_actors: Set[Actor] = set()
+        self._next_entity_id = 0
+        self._id_of_entity: Dict[Entity, int] = {}
+        self._entity_by_id: Dict[int, Entity] = {}
+        self._indexed_at: Dict[Entity, Tuple[int, int]] = {}  # Where each blocking entity was last indexed.
 
-        self.explored = np.full(
-            (self.map_width, self.map_height), fill_value=False, order="F"
-        )  # Tiles the player has seen before
+        # Optional struct-of-arrays mirror of the entities, for vectorized queries.
+        self.entity_store: Optional[EntityStore] = EntityStore() if use_entity_store else None
+
+        """
+        Every entity, blocking or not, bucketed by the entity_block_size square block of the map it's in (also kept
+        up to date by reindex_entity), so render only has to look at the blocks under the viewport. The buckets are
+        dicts used as ordered sets, so entities come out in the order they arrived and frames always draw the same.
+        """
+        self._entity_blocks: Dict[Tuple[int, int], Dict[Entity, None]] = {}
+        self._block_of: Dict[Entity, Tuple[int, int]] = {}
 
         """
-        For now, creating separate "viewports" for the visible and explored matrices. It would be nice to add this to
-        the tile metadata.. but I'll go down that road later. 
+        Render cache. _tile_layer is the composed viewport from the last frame, and the _layer_* attributes are the
+        inputs it was composed from. render() only recomposes the cells whose visibility changed since then, or the
+        whole layer if the viewport moved or invalidate_render_cache() was called after editing map_tiles.
+        """
+        self._tile_layer: Optional[np.ndarray] = None
+        self._layer_origin = (0, 0)
+        self._layer_visible = np.zeros((self.view_width, self.view_height), dtype=bool, order="F")
+        self._layer_explored = np.zeros((self.view_width, self.view_height), dtype=bool, order="F")
+
+        for entity in entities:
+            self.add_entity(entity)
+
+        """
+        Current viewport implementation. Keep in mind that for a plain GameMap these are "views" and not "copies" of
+        the full arrays. For now, creating separate "viewports" for the visible and explored matrices. It would be nice
+        to add this to the tile metadata.. but I'll go down that road later.
+        """
+        self.update_viewport()
+
+    def new_layer(self, name: str, fill_value: Any, dtype: Any = None) -> np.ndarray:
         """
-        self.visible_vp = self.visible[self.viewport_origin_x:self.viewport_origin_x + self.view_width,
-                                       self.viewport_origin_y:self.viewport_origin_y + self.view_height]
-        self.explored_vp = self.explored[self.viewport_origin_x:self.viewport_origin_x + self.view_width,
-                                         self.viewport_origin_y:self.viewport_origin_y + self.view_height]
+        Allocate one full-map layer (map_tiles, visible, explored or entity_ids).
+
+        Subclasses can override this to store the layers differently, see chunked_map.ChunkedGameMap.
+        """
+        return np.full((self.map_width, self.map_height), fill_value=fill_value, dtype=dtype, order="F")
+
+    def update_viewport(self) -> None:
+        """
+        Re-slice the viewport layers from the current viewport origin.
+
+        When the viewport is completely inside a plain map these are just slices of the map layers. When it hangs off
+        an edge, the part that's on the map is copied into view-sized arrays padded with unexplored wall instead (and
+        chunked layers are always copied). Copies go stale, see refresh_viewport().
+        """
+        x0, y0 = self.viewport_origin_x, self.viewport_origin_y
+        x1, y1 = x0 + self.view_width, y0 + self.view_height
+        # The part of the viewport that is actually on the map.
+        map_x0, map_y0 = max(0, x0), max(0, y0)
+        map_x1, map_y1 = min(self.map_width, x1), min(self.map_height, y1)
+
+        if (map_x0, map_y0, map_x1, map_y1) == (x0, y0, x1, y1):
+            view = slice(x0, x1), slice(y0, y1)
+            self.viewport_tiles = self.map_tiles[view]
+            self.visible_vp = self.visible[view]
+            self.explored_vp = self.explored[view]
+            self._viewport_copied = not isinstance(self.map_tiles, np.ndarray)
+            return
+
+        self._viewport_copied = True
+        shape = (self.view_width, self.view_height)
+        self.viewport_tiles = np.full(shape, fill_value=tile_types.wall, dtype=tile_types.tile_id_dt, order="F")
+        self.visible_vp = np.zeros(shape, dtype=bool, order="F")
+        self.explored_vp = np.zeros(shape, dtype=bool, order="F")
+        if map_x0 < map_x1 and map_y0 < map_y1:
+            on_map = slice(map_x0, map_x1), slice(map_y0, map_y1)
+            in_view = slice(map_x0 - x0, map_x1 - x0), slice(map_y0 - y0, map_y1 - y0)
+            self.viewport_tiles[in_view] = self.map_tiles[on_map]
+            self.visible_vp[in_view] = self.visible[on_map]
+            self.explored_vp[in_view] = self.explored[on_map]
+
+    def refresh_viewport(self) -> None:
+        """
+        Bring the viewport layers up to date after map_tiles, visible or explored changed. Only copies need it, so
+        this is free while the viewport is a slice of the map. The camera moving is handled by update_viewport().
+        """
+        if self._viewport_copied:
+            self.update_viewport()
+
+    def close(self) -> None:
+        """Release anything the map keeps outside of memory. A plain GameMap keeps nothing, see ChunkedGameMap."""
+
+    def path_window(self, x_a: int, y_a: int, x_b: int, y_b: int) -> Tuple[int, int, int, int]:
+        """Return the (x0, y0, x1, y1) area pathfinding between two points should consider: the whole map here."""
+        return 0, 0, self.map_width, self.map_height
 
     @property
     def actors(self) -> Iterator[Actor]:
         """Iterate over this map's living actors"""
-        yield from (
-            entity
-            for entity in self.entities
-            if isinstance(entity, Actor) and entity.is_alive
-        )
+        yield from self.living_actors
+
+    def entity_id(self, entity: Entity) -> int:
+        """Return the id an entity was given when it was added to this map. Ids are never reused."""
+        return self._id_of_entity[entity]
+
+    def entity_with_id(self, entity_id: int) -> Entity:
+        return self._entity_by_id[entity_id]
+
+    def add_entity(self, entity: Entity) -> None:
+        """Add an entity to this map and register it in the position index."""
+        if entity not in self._id_of_entity:
+            self._id_of_entity[entity] = self._next_entity_id
+            self._entity_by_id[self._next_entity_id] = entity
+            self._next_entity_id += 1
+        self.entities.add(entity)
+        self.reindex_entity(entity)
+
+    def remove_entity(self, entity: Entity) -> None:
+        """Remove an entity from this map and from the position index."""
+        self._unindex_entity(entity)
+        self.living_actors.discard(entity)
+        self.entities.discard(entity)
+        block = self._block_of.pop(entity, None)
+        if block is not None:
+            self._leave_block(entity, block)
+        entity_id = self._id_of_entity.pop(entity, None)
+        if entity_id is not None:
+            del self._entity_by_id[entity_id]
+        if self.entity_store is not None:
+            self.entity_store.remove(entity)
+
+    def reindex_entity(self, entity: Entity) -> None:
+        """
+        Update the position index after an entity moved, started/stopped blocking, or died.
+
+        Only blocking entities go into entity_ids. Movement never lets two blocking entities share a tile, so
+        one id per tile is enough.
+        """
+        self._unindex_entity(entity)
+        if entity.blocks_movement:
+            self.entity_ids[entity.map_x, entity.map_y] = self._id_of_entity[entity]
+            self._indexed_at[entity] = (entity.map_x, entity.map_y)
+
+        if isinstance(entity, Actor) and entity.is_alive:
+            self.living_actors.add(entity)
+        else:
+            self.living_actors.discard(entity)
+
+        block = entity.map_x // self.entity_block_size, entity.map_y // self.entity_block_size
+        old_block = self._block_of.get(entity)
+        if block != old_block:
+            if old_block is not None:
+                self._leave_block(entity, old_block)
+            self._entity_blocks.setdefault(block, {})[entity] = None
+            self._block_of[entity] = block
+
+        if self.entity_store is not None:
+            self.entity_store.sync(entity)
+
+    def update_entity_stats(self, entity: Actor) -> None:
+        """Called by Fighter when an actor's hp changes, so the entity store doesn't go stale."""
+        if self.entity_store is not None:
+            self.entity_store.sync_stats(entity)
+
+    def living_actors_in_rect(self, x0: int, y0: int, x1: int, y1: int) -> List[Actor]:
+        """
+        Return every living actor inside the rectangle [x0, x1) x [y0, y1), in no particular order. The rectangle
+        must be on the map.
+
+        Living actors always block movement, so they're all in the blocking index, and only the rectangle of it is
+        read. That's cheaper than a mask over the whole entity store, so it's used with or without one.
+        """
+        ids = self.entity_ids[x0:x1, y0:y1]
+        entities = (self._entity_by_id[entity_id] for entity_id in ids[ids >= 0].tolist())
+        return [entity for entity in entities if entity in self.living_actors]
+
+    def entities_in_rect(self, x0: int, y0: int, x1: int, y1: int) -> Iterator[Entity]:
+        """Iterate over every entity inside the rectangle [x0, x1) x [y0, y1), always in the same order."""
+        size = self.entity_block_size
+        for block_x in range(max(0, x0) // size, (max(x0, x1) - 1) // size + 1):
+            for block_y in range(max(0, y0) // size, (max(y0, y1) - 1) // size + 1):
+                for entity in self._entity_blocks.get((block_x, block_y), ()):
+                    if x0 <= entity.map_x < x1 and y0 <= entity.map_y < y1:
+                        yield entity
+
+    def _leave_block(self, entity: Entity, block: Tuple[int, int]) -> None:
+        bucket = self._entity_blocks[block]
+        del bucket[entity]
+        if not bucket:
+            del self._entity_blocks[block]
+
+    def _unindex_entity(self, entity: Entity) -> None:
+        location = self._indexed_at.pop(entity, None)
+        if location is not None and self.entity_ids[location] == self._id_of_entity[entity]:
+            self.entity_ids[location] = -1
 
     def focus_viewport(self, player_x: int, player_y: int):
         """Recalculates viewport origin based on new player coordinates. Maybe I should just call this
         whenever MovementActions are performed?"""
         self.viewport_origin_x = int(player_x - self.view_width / 2)
         self.viewport_origin_y = int(player_y - self.view_height / 2 + 1)
-        self.viewport_tiles = self.map_tiles[self.viewport_origin_x:self.viewport_origin_x + self.view_width,
-                                             self.viewport_origin_y:self.viewport_origin_y + self.view_height]
-        self.visible_vp = self.visible[self.viewport_origin_x:self.viewport_origin_x + self.view_width,
-                                       self.viewport_origin_y:self.viewport_origin_y + self.view_height]
-        self.explored_vp = self.explored[self.viewport_origin_x:self.viewport_origin_x + self.view_width,
-                                         self.viewport_origin_y:self.viewport_origin_y + self.view_height]
+        self.update_viewport()
+        self.engine.needs_render = True
 
     def get_blocking_entity_at_location(self, location_x: int, location_y: int) -> Optional[Entity]:
-        for entity in self.entities:
-            if (
-                entity.blocks_movement
-                and entity.map_x == location_x
-                and entity.map_y == location_y
-            ):
-                return entity
-
-        return None
+        entity_id = self.entity_ids[location_x, location_y]
+        if entity_id < 0:
+            return None
+        return self._entity_by_id[entity_id]
 
     def get_actor_at_location(self, x: int, y: int) -> Optional[Actor]:
-        for actor in self.actors:
-            if actor.map_x == x and actor.map_y == y:
-                return actor
+        # Living actors always block movement, so they can be looked up through the blocking index.
+        entity = self.get_blocking_entity_at_location(x, y)
+        if entity in self.living_actors:
+            return entity
 
         return None
 
-    def in_bounds(self, x: int, y: int) -> bool:  # This is broken
+    def in_bounds(self, x: int, y: int) -> bool:
         """Return True if x and y are inside of the bounds of the map."""
-        return self.buffer_x <= x < self.buffer_x + self.map_width and self.buffer_y <= y < self.buffer_y + \
-               self.map_height
+        return 0 <= x < self.map_width and 0 <= y < self.map_height
 
     def scroll_viewport(self, dx: int, dy: int) -> None:
         """
@@ -112,12 +281,13 @@ class GameMap:
         """
         self.viewport_origin_x += dx
         self.viewport_origin_y += dy
-        self.viewport_tiles = self.map_tiles[self.viewport_origin_x:self.viewport_origin_x+self.view_width,
-                                             self.viewport_origin_y:self.viewport_origin_y+self.view_height]
-        self.visible_vp = self.visible[self.viewport_origin_x:self.viewport_origin_x + self.view_width,
-                                       self.viewport_origin_y:self.viewport_origin_y + self.view_height]
-        self.explored_vp = self.explored[self.viewport_origin_x:self.viewport_origin_x + self.view_width,
-                                         self.viewport_origin_y:self.viewport_origin_y + self.view_height]
+        self.update_viewport()
+        self.engine.needs_render = True
+
+    def invalidate_render_cache(self) -> None:
+        """Force the next render to recompose the whole viewport. Call this after changing map_tiles."""
+        self._tile_layer = None
+        self.refresh_viewport()
 
     def render(self, console: Console) -> None:
         # console.tiles_rgb[0:self.view_width, 0:self.view_height] = self.viewport_tiles["dark"]
@@ -128,25 +298,57 @@ class GameMap:
         If it isn't, but it's in the "explored" array, then draw it with the "dark" colors.
         Otherwise, the default is "SHROUD".
         """
-        console.tiles_rgb[0 : self.view_width, 0 : self.view_height] = np.select(
-            condlist=[self.visible_vp, self.explored_vp],
-            choicelist=[self.viewport_tiles["light"], self.viewport_tiles["dark"]],
-            default=tile_types.SHROUD
-        )
+        origin = (self.viewport_origin_x, self.viewport_origin_y)
+        if self._tile_layer is None or origin != self._layer_origin:
+            self._tile_layer = np.select(
+                condlist=[self.visible_vp, self.explored_vp],
+                choicelist=[tile_types.LIGHT[self.viewport_tiles], tile_types.DARK[self.viewport_tiles]],
+                default=tile_types.SHROUD
+            )
+            self._layer_origin = origin
+        else:
+            # Same viewport as last frame, so only the cells that came into or went out of view need redrawing.
+            changed = (self.visible_vp != self._layer_visible) | (self.explored_vp != self._layer_explored)
+            if changed.any():
+                changed_tiles = self.viewport_tiles[changed]
+                self._tile_layer[changed] = np.select(
+                    condlist=[self.visible_vp[changed], self.explored_vp[changed]],
+                    choicelist=[tile_types.LIGHT[changed_tiles], tile_types.DARK[changed_tiles]],
+                    default=tile_types.SHROUD
+                )
+        self._layer_visible[:] = self.visible_vp
+        self._layer_explored[:] = self.explored_vp
+
+        console.tiles_rgb[0 : self.view_width, 0 : self.view_height] = self._tile_layer
 
-        entities_sorted_for_rendering = sorted(
-            self.entities, key=lambda x: x.render_order.value
-        )
+        if self.entity_store is not None:
+            self._render_entities_from_store(console)
+            return
 
         """
-        The following calculates the viewport coordinates for each entity, checks to make sure that
-        the coordinates are actually within the current viewport, and then prints them to the viewport.
-        
+        The following looks up the entities inside the viewport, keeps the ones in the FOV, and prints them to the
+        viewport. They're drawn from lowest to highest render order so actors end up on top of corpses.
         """
-        for entity in entities_sorted_for_rendering:
-            # Only print entities that are in the FOV.
-            if self.visible[entity.map_x, entity.map_y]:
-                view_x = entity.map_x - self.viewport_origin_x
-                view_y = entity.map_y - self.viewport_origin_y
-                if (0 <= view_x < self.view_width) and (0 <= view_y < self.view_height):
-                    console.print(x=view_x, y=view_y, string=entity.char, fg=entity.color)
+        x0, y0 = self.viewport_origin_x, self.viewport_origin_y
+        layers: Dict[RenderOrder, List[Entity]] = {order: [] for order in RenderOrder}
+        for entity in self.entities_in_rect(x0, y0, x0 + self.view_width, y0 + self.view_height):
+            if self.visible_vp[entity.map_x - x0, entity.map_y - y0]:
+                layers[entity.render_order].append(entity)
+        for order in RenderOrder:
+            for entity in layers[order]:
+                console.ch[entity.map_x - x0, entity.map_y - y0] = ord(entity.char)
+                console.fg[entity.map_x - x0, entity.map_y - y0] = entity.color
+
+    def _render_entities_from_store(self, console: Console) -> None:
+        """Same as the entity loop in render(), but as a handful of array operations over the entity store."""
+        store = self.entity_store
+        # Every entity on a visible cell of the viewport. The position index finds the ones in the viewport.
+        x0, y0 = self.viewport_origin_x, self.viewport_origin_y
+        in_view = store.rows_of(self.entities_in_rect(x0, y0, x0 + self.view_width, y0 + self.view_height))
+        rows = store.rows_where(self.visible_vp, in_view, x0, y0)
+        for order in RenderOrder:
+            drawn = rows[store.render_order[rows] == order.value]
+            view_x = store.x[drawn] - self.viewport_origin_x
+            view_y = store.y[drawn] - self.viewport_origin_y
+            console.ch[view_x, view_y] = store.glyph[drawn]
+            console.fg[view_x, view_y] = store.color[drawn]
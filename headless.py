@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""
+Runs the game without a window or any rendering, with a scripted policy standing in for the player.
+
+This is meant for testing the AI and procgen at scale (e.g. on CI boxes with no display), so it reports how many turns
+per second the engine manages. Example:
+
+    python headless.py --turns 5000 --policy seek --map-width 400 --map-height 400 --max-rooms 600
+"""
+from __future__ import annotations
+
+import argparse
+import random
+import time
+from typing import Callable, Iterator, Optional
+
+import tcod.event
+
+from actions import Action, BumpAction, WaitAction
+from engine import Engine
+import entity_factories
+from input_handlers import MainGameEventHandler, MOVE_KEYS, WAIT_KEYS
+from message_log import MessageLog
+from procgen import generate_chunked_world, generate_dungeon
+from replay import ReplayRecorder
+
+# A policy looks at the engine and decides the player's next action. Returning None skips the turn.
+Policy = Callable[[Engine], Optional[Action]]
+
+DIRECTIONS = sorted(set(MOVE_KEYS.values()))
+
+
+def random_walk_policy(seed: int = 0) -> Policy:
+    """Bump in a random direction every turn. Uses its own RNG so it doesn't disturb the game's."""
+    rng = random.Random(seed)
+
+    def policy(engine: Engine) -> Optional[Action]:
+        return BumpAction(engine.player, *rng.choice(DIRECTIONS))
+
+    return policy
+
+
+def scripted_keys_policy(keys: str) -> Policy:
+    """
+    Replay a string of keys (vi keys and "." to wait) through the normal key handler, looping when it runs out.
+    Raises ValueError if a key doesn't map to an action, since a script of those would never take a turn.
+    """
+    unmapped = sorted({key for key in keys if ord(key) not in MOVE_KEYS and ord(key) not in WAIT_KEYS})
+    if not keys or unmapped:
+        raise ValueError(f"Keys that don't take a turn: {''.join(unmapped) or '(none given)'}")
+    key_cycle: Iterator[str] = iter(())
+
+    def policy(engine: Engine) -> Optional[Action]:
+        nonlocal key_cycle
+        key = next(key_cycle, None)
+        if key is None:
+            key_cycle = iter(keys)
+            key = next(key_cycle)
+        event = tcod.event.KeyDown(scancode=0, sym=ord(key), mod=0)
+        return engine.event_handler.ev_keydown(event)
+
+    return policy
+
+
+def seek_nearest_enemy_policy(seed: int = 0) -> Policy:
+    """Walk toward (and attack) the closest living enemy. Wanders randomly when no enemy can be reached."""
+    wander = random_walk_policy(seed)
+
+    def policy(engine: Engine) -> Optional[Action]:
+        player = engine.player
+        enemies = [actor for actor in engine.game_map.actors if actor is not player]
+        if not enemies:
+            return WaitAction(player)
+
+        # Ties go to the enemy with the lowest entity id, so runs are reproducible.
+        target = min(
+            enemies,
+            key=lambda actor: (
+                max(abs(actor.map_x - player.map_x), abs(actor.map_y - player.map_y)),
+                engine.game_map.entity_id(actor),
+            ),
+        )
+        # The cached path only gets extended as the target moves, so this rarely calls the pathfinder.
+        step = player.ai.step_toward(target.map_x, target.map_y)
+        if step is None:
+            return wander(engine)
+
+        dest_x, dest_y = step
+        return BumpAction(player, dest_x - player.map_x, dest_y - player.map_y)
+
+    return policy
+
+
+def new_engine(
+        seed: int,
+        map_width: int = 80,
+        map_height: int = 45,
+        view_width: int = 80,
+        view_height: int = 45,
+        room_min_size: int = 6,
+        room_max_size: int = 10,
+        max_rooms: int = 30,
+        max_monsters_per_room: int = 2,
+        chunked: bool = False,
+        spill_dir: Optional[str] = None,
+        use_entity_store: bool = False,
+) -> Engine:
+    """
+    Build an engine and dungeon the same way main.py does, but from an explicit seed.
+
+    With chunked=True the map is a lazily generated ChunkedGameMap instead (max_rooms is ignored).
+    """
+    random.seed(seed)
+    player = entity_factories.player.clone()
+    engine = Engine(player=player)
+    if chunked:
+        engine.game_map = generate_chunked_world(
+            world_width=map_width,
+            world_height=map_height,
+            view_width=view_width,
+            view_height=view_height,
+            room_min_size=room_min_size,
+            room_max_size=room_max_size,
+            max_monsters_per_room=max_monsters_per_room,
+            engine=engine,
+            seed=seed,
+            spill_dir=spill_dir,
+            use_entity_store=use_entity_store,
+        )
+        engine.update_fov()
+        return engine
+
+    engine.game_map = generate_dungeon(
+        max_rooms=max_rooms,
+        room_min_size=room_min_size,
+        room_max_size=room_max_size,
+        map_width=map_width,
+        map_height=map_height,
+        view_width=view_width,
+        view_height=view_height,
+        max_monsters_per_room=max_monsters_per_room,
+        engine=engine,
+        use_entity_store=use_entity_store,
+    )
+    engine.update_fov()
+    return engine
+
+
+def run_headless(engine: Engine, policy: Policy, turns: int) -> int:
+    """
+    Play up to `turns` turns with the given policy and return how many were actually played.
+
+    Stops early if the player dies or the policy asks to quit. A turn the policy skips (by returning None) still
+    counts toward `turns`, so a policy that keeps skipping can't hang the run; it just isn't counted as played.
+    """
+    played = 0
+    for _ in range(turns):
+        handler = engine.event_handler
+        if not isinstance(handler, MainGameEventHandler):
+            break  # The player died, so the game is over.
+
+        action = policy(engine)
+        if action is None:
+            continue
+        try:
+            handler.handle_action(action)
+        except SystemExit:
+            break
+        played += 1
+
+    return played
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run the game headless and report turns per second.")
+    parser.add_argument("--turns", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--policy", choices=("random", "keys", "seek"), default="random")
+    parser.add_argument("--keys", default="hjklyubn.", help="Key script for the 'keys' policy.")
+    parser.add_argument("--map-width", type=int, default=80)
+    parser.add_argument("--map-height", type=int, default=45)
+    parser.add_argument("--max-rooms", type=int, default=30)
+    parser.add_argument("--max-monsters-per-room", type=int, default=2)
+    parser.add_argument("--chunked", action="store_true", help="Use a lazily generated chunked world.")
+    parser.add_argument("--spill-dir", help="Directory for memory-mapped cold chunks (with --chunked).")
+    parser.add_argument("--entity-store", action="store_true", help="Mirror entities into a struct-of-arrays store.")
+    parser.add_argument(
+        "--sequential-enemy-turns", action="store_true", help="Run each enemy's AI on its own instead of batching.",
+    )
+    parser.add_argument(
+        "--path-workers", type=int, help="Threads for solving enemy paths (default: one per core, 0: no path service).",
+    )
+    parser.add_argument("--message-log", help="Also write every game message to this file, as tab separated values.")
+    parser.add_argument("--profile-csv", help="Time each phase of every turn and write the results to this CSV file.")
+    parser.add_argument("--record", help="Record the player's actions to this file, for replay.py.")
+    args = parser.parse_args()
+    if args.record and args.chunked:
+        parser.error("--record doesn't support --chunked worlds")
+
+    start = time.perf_counter()
+    engine = new_engine(
+        seed=args.seed,
+        map_width=args.map_width,
+        map_height=args.map_height,
+        max_rooms=args.max_rooms,
+        max_monsters_per_room=args.max_monsters_per_room,
+        chunked=args.chunked,
+        spill_dir=args.spill_dir,
+        use_entity_store=args.entity_store,
+    )
+    engine.batch_enemy_turns = not args.sequential_enemy_turns
+    if args.path_workers == 0:
+        engine.path_service = None
+    elif args.path_workers:
+        engine.path_service.max_workers = args.path_workers
+    if args.message_log:
+        engine.message_log = MessageLog(sink_path=args.message_log)
+    engine.profiler.enabled = bool(args.profile_csv)
+    if args.record:
+        engine.recorder = ReplayRecorder(
+            args.record,
+            seed=args.seed,
+            builder="headless",
+            params=dict(
+                map_width=args.map_width,
+                map_height=args.map_height,
+                max_rooms=args.max_rooms,
+                max_monsters_per_room=args.max_monsters_per_room,
+            ),
+            engine=engine,
+        )
+    generated = time.perf_counter()
+
+    if args.policy == "keys":
+        try:
+            policy = scripted_keys_policy(args.keys)
+        except ValueError as error:
+            parser.error(str(error))
+    elif args.policy == "seek":
+        policy = seek_nearest_enemy_policy(args.seed)
+    else:
+        policy = random_walk_policy(args.seed)
+
+    try:
+        played = run_headless(engine, policy, args.turns)
+        elapsed = time.perf_counter() - generated
+    finally:
+        engine.message_log.close()
+        if engine.recorder is not None:
+            engine.recorder.close()
+        if engine.path_service is not None:
+            engine.path_service.close()
+        engine.game_map.close()
+    if args.profile_csv:
+        engine.profiler.export_csv(args.profile_csv)
+
+    monsters = sum(1 for actor in engine.game_map.actors if actor is not engine.player)
+    print(f"Generated {args.map_width}x{args.map_height} dungeon in {generated - start:.3f}s")
+    print(f"Played {played} turns in {elapsed:.3f}s ({played / max(elapsed, 1e-9):.1f} turns/s)")
+    print(f"Player HP: {engine.player.fighter.hp}/{engine.player.fighter.max_hp}, monsters alive: {monsters}")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,7 @@ from typing import Optional, TYPE_CHECKING
 import tcod.event
 
 from actions import Action, EscapeAction, BumpAction, WaitAction
+from turn_profiler import profile_csv_name
 
 if TYPE_CHECKING:
     from engine import Engine
@@ -50,26 +51,46 @@ class EventHandler(tcod.event.EventDispatch[Action]):
     def __init__(self, engine: Engine):
         self.engine = engine
 
-    def handle_events(self) -> None:
+    def handle_events(self, timeout: Optional[float] = None) -> None:
+        """Handle every pending event, waiting up to `timeout` seconds (or forever if None) for the first one."""
         raise NotImplementedError()
 
     def ev_quit(self, event: tcod.event.Quit()) -> Optional[Action]:
         raise SystemExit()
 
+    def ev_windowexposed(self, event: tcod.event.WindowEvent) -> Optional[Action]:
+        self.engine.needs_render = True  # The window contents were lost, e.g. after being covered or restored.
+        return None
+
 
 class MainGameEventHandler(EventHandler):
 
-    def handle_events(self) -> None:
-        for event in tcod.event.wait():
+    def handle_events(self, timeout: Optional[float] = None) -> None:
+        for event in tcod.event.wait(timeout):
             action = self.dispatch(event)
 
             if action is None:
                 continue
 
+            self.handle_action(action)
+
+    def handle_action(self, action: Action) -> None:
+        """Perform the player's action and then advance the rest of the turn."""
+        profiler = self.engine.profiler
+        if self.engine.recorder is not None:
+            self.engine.recorder.record(action)
+        with profiler.phase("player_action"):
             action.perform()
+        self.engine.needs_render = True
 
+        with profiler.phase("enemy_turns"):
             self.engine.handle_enemy_turns()
+        with profiler.phase("fov"):
             self.engine.update_fov()  # Update the FOV before the player's next action.
+        profiler.end_turn(self.engine.turn)
+        self.engine.turn += 1
+        if self.engine.autosaver is not None:
+            self.engine.autosaver.on_turn()
 
     def ev_keydown(self, event: tcod.event.KeyDown) -> Optional[Action]:
         action: Optional[Action] = None
@@ -85,14 +106,20 @@ class MainGameEventHandler(EventHandler):
             action = WaitAction(player)
         elif key == tcod.event.K_ESCAPE:
             action = EscapeAction(player)
+        elif key == tcod.event.K_F3:
+            # Performance overlay. This doesn't take a turn.
+            self.engine.profiler.toggle()
+            self.engine.needs_render = True
+        elif key == tcod.event.K_F4 and self.engine.profiler.enabled:
+            self.engine.profiler.export_csv(profile_csv_name())
 
         # No valid key was pressed
         return action
 
 
 class GameOverEventHandler(EventHandler):
-    def handle_events(self) -> None:
-        for event in tcod.event.wait():
+    def handle_events(self, timeout: Optional[float] = None) -> None:
+        for event in tcod.event.wait(timeout):
             action = self.dispatch(event)
 
             if action is None:
@@ -0,0 +1,186 @@
+"""
+Packing a GameMap into plain numpy arrays and back. This is shared by the level cache and by save games.
+
+A level becomes a handful of arrays:
+
+    map_tiles   tile ids
+    explored    bool
+    rooms       one (x1, y1, x2, y2) row per room
+    entities    an entity_dt record per entity, in entity id order
+
+Entities are rebuilt from their records alone, so nothing needs pickling. AI state that's cheap to work out again
+(cached paths) is dropped; what an enemy remembers (where it last saw the player) is kept.
+"""
+from __future__ import annotations
+
+import os
+from typing import Dict, Iterable, List, Optional, TYPE_CHECKING
+
+import numpy as np  # type: ignore
+
+from components.ai import BaseAI, HostileEnemy
+from components.fighter import Fighter
+from entity import Actor, Entity
+from game_map import GameMap
+from procgen import RectangularRoom
+from render_order import RenderOrder
+
+if TYPE_CHECKING:
+    from engine import Engine
+
+# AI classes by the code they're stored as. 0 means no AI class at all (a plain Entity).
+AI_CLASSES = [None, BaseAI, HostileEnemy]
+AI_CODES = {ai_cls: code for code, ai_cls in enumerate(AI_CLASSES)}
+
+# Names are stored as fixed-width strings so the tables load without pickle and can be memory-mapped.
+NAME_LENGTH = 32
+
+entity_dt = np.dtype(
+    [
+        ("ai_cls", np.uint8),  # Index into AI_CLASSES.
+        ("alive", np.bool_),  # Whether an actor still has its AI.
+        ("x", np.int32),
+        ("y", np.int32),
+        ("char", np.uint32),  # Unicode codepoint.
+        ("color", np.uint8, 3),
+        ("name", f"U{NAME_LENGTH}"),
+        ("blocks_movement", np.bool_),
+        ("render_order", np.uint8),
+        ("hp", np.int32),
+        ("max_hp", np.int32),
+        ("defense", np.int32),
+        ("power", np.int32),
+        ("speed", np.int32),
+        ("last_seen", np.int32, 2),  # (-1, -1) if none.
+    ]
+)
+
+
+def _entity_record(entity: Entity) -> tuple:
+    if len(entity.name) > NAME_LENGTH:
+        # numpy would cut it short without a word, and the entity would come back with another name.
+        raise ValueError(f"Entity name {entity.name!r} is longer than {NAME_LENGTH} characters, so it can't be saved")
+    common = (
+        entity.map_x, entity.map_y, ord(entity.char), entity.color, entity.name, entity.blocks_movement,
+        entity.render_order.value,
+    )
+    if not isinstance(entity, Actor):
+        return (0, False, *common, 0, 0, 0, 0, 0, (-1, -1))
+    fighter = entity.fighter
+    return (
+        AI_CODES[entity.ai_cls], entity.is_alive, *common,
+        fighter.hp, fighter.max_hp, fighter.defense, fighter.power, entity.speed,
+        getattr(entity.ai, "last_seen", None) or (-1, -1),
+    )
+
+
+def pack_entity_list(entities: Iterable[Entity]) -> np.ndarray:
+    """Return an entity_dt table with a record for each of these entities, in order."""
+    return np.array([_entity_record(entity) for entity in entities], dtype=entity_dt)
+
+
+def pack_entities(game_map: GameMap, exclude: Optional[Entity] = None) -> np.ndarray:
+    """Return an entity_dt table of the entities on a map (minus `exclude`, normally the player)."""
+    return pack_entity_list(
+        sorted((entity for entity in game_map.entities if entity is not exclude), key=game_map.entity_id)
+    )
+
+
+def unpack_entity(record: tuple) -> Entity:
+    """Rebuild one entity from an entity_dt record (as a tuple, e.g. from table.tolist()). It isn't on a map yet."""
+    (ai_code, alive, x, y, char, color, name, blocks_movement, render_order, hp, max_hp, defense, power, speed,
+     last_seen) = record
+    if ai_code:
+        fighter = Fighter(hp=max_hp, defense=defense, power=power)
+        fighter._hp = hp  # Straight to the field: this is a restore, not damage, so there's nothing to trigger.
+        entity: Entity = Actor(
+            char=chr(char), color=tuple(color), name=name, ai_cls=AI_CLASSES[ai_code], fighter=fighter, speed=speed,
+        )
+        if not alive:
+            entity.ai = None
+        elif last_seen[0] >= 0 and hasattr(entity.ai, "last_seen"):
+            entity.ai.last_seen = tuple(last_seen)
+    else:
+        entity = Entity(char=chr(char), color=tuple(color), name=name)
+    entity.blocks_movement = blocks_movement
+    entity.render_order = RenderOrder(render_order)
+    entity.map_x = x
+    entity.map_y = y
+    return entity
+
+
+def unpack_entities(table: np.ndarray, game_map: GameMap) -> List[Entity]:
+    """Rebuild the entities of an entity_dt table on a map, in table order."""
+    entities: List[Entity] = []
+    for record in table.tolist():
+        entity = unpack_entity(record)
+        entity.game_map = game_map
+        game_map.add_entity(entity)
+        entities.append(entity)
+    return entities
+
+
+def pack_level(game_map: GameMap, exclude: Optional[Entity] = None) -> Dict[str, np.ndarray]:
+    """Return the arrays describing a level. The tile arrays are the map's own, not copies."""
+    return {
+        "map_tiles": np.asarray(game_map.map_tiles),
+        "explored": np.asarray(game_map.explored),
+        "rooms": np.array(
+            [(room.x1, room.y1, room.x2, room.y2) for room in game_map.rooms], dtype=np.int32
+        ).reshape(-1, 4),
+        "entities": pack_entities(game_map, exclude),
+    }
+
+
+def unpack_level(
+        arrays: Dict[str, np.ndarray], engine: Engine, view_width: int, view_height: int,
+        use_entity_store: bool = False, share_arrays: bool = False,
+) -> GameMap:
+    """
+    Build a GameMap from the arrays made by pack_level. The player isn't placed on it.
+
+    With share_arrays=True the map uses the tile arrays it's given instead of copying them, which is what makes
+    loading from memory-mapped files cheap. They must then be writable (a copy-on-write memmap is fine).
+    """
+    map_width, map_height = arrays["map_tiles"].shape
+    game_map = GameMap(engine, map_width, map_height, view_width, view_height, use_entity_store=use_entity_store)
+    if share_arrays:
+        game_map.map_tiles = arrays["map_tiles"]
+        game_map.explored = arrays["explored"]
+    else:
+        game_map.map_tiles[:] = arrays["map_tiles"]
+        game_map.explored[:] = arrays["explored"]
+    game_map.update_viewport()
+    game_map.rooms = [RectangularRoom(x1, y1, x2 - x1, y2 - y1) for x1, y1, x2, y2 in arrays["rooms"].tolist()]
+    unpack_entities(arrays["entities"], game_map)
+    return game_map
+
+
+def save_level(path: str, game_map: GameMap, exclude: Optional[Entity] = None, **extra: np.ndarray) -> None:
+    """Write a level to a compressed .npz file. Any extra arrays are stored alongside it."""
+    np.savez_compressed(path, **pack_level(game_map, exclude), **extra)
+
+
+def write_level_arrays(path: str, arrays: Dict[str, np.ndarray], compress: bool = False) -> None:
+    """
+    Write packed level arrays to disk. Uncompressed they go into a directory of raw .npy files, which
+    load_level_arrays can memory-map; compressed they go into a single .npz file, which has to be read in full.
+    """
+    if compress:
+        np.savez_compressed(path, **arrays)
+        return
+    os.makedirs(path, exist_ok=True)
+    for name, array in arrays.items():
+        np.save(os.path.join(path, f"{name}.npy"), array)
+
+
+def load_level_arrays(path: str, mmap_mode: Optional[str] = None) -> Dict[str, np.ndarray]:
+    """Read arrays written by write_level_arrays or save_level. mmap_mode only applies to the .npy directories."""
+    if os.path.isdir(path):
+        return {
+            name[:-len(".npy")]: np.load(os.path.join(path, name), mmap_mode=mmap_mode)
+            for name in os.listdir(path)
+            if name.endswith(".npy")
+        }
+    with np.load(path) as data:
+        return {name: data[name] for name in data.files}
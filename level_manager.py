@@ -0,0 +1,183 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+import os
+import shutil
+import tempfile
+import threading
+from typing import Any, Dict, List, Optional, Tuple, TYPE_CHECKING
+
+import level_io
+
+if TYPE_CHECKING:
+    from engine import Engine
+    from game_map import GameMap
+    from level_pipeline import LevelPipeline
+    from save_game import SaveInfo
+
+
+class LevelManager:
+    """
+    Keeps track of every level the player has been to.
+
+    The current level and up to `max_cached` other recently visited levels stay in memory as GameMaps. Older ones are
+    written to .npz files in cache_dir with level_io (tiles, explored and a packed entity table) and dropped, then
+    loaded back when the player returns. New levels come from the level pipeline. So memory stays bounded however
+    deep a run goes, and no level is ever generated twice.
+
+    Only dense GameMaps can be cached; a ChunkedGameMap would need its chunk files kept instead.
+    """
+
+    def __init__(
+            self,
+            engine: Engine,
+            pipeline: LevelPipeline,
+            max_cached: int = 3,
+            cache_dir: Optional[str] = None,
+            use_entity_store: bool = False,
+    ):
+        self.engine = engine
+        self.pipeline = pipeline
+        self.max_cached = max_cached
+        self.use_entity_store = use_entity_store  # For every level, whether new or loaded back from cache_dir.
+        self._own_cache_dir = cache_dir is None
+        self.cache_dir = tempfile.mkdtemp(prefix="levels-") if cache_dir is None else cache_dir
+        self.depth = 0  # 0 until the first level is entered.
+        self._in_memory: OrderedDict[int, GameMap] = OrderedDict()  # Least recently used first.
+        self._on_disk: Dict[int, str] = {}
+        self._player_positions: Dict[int, Tuple[int, int]] = {}  # Where the player was when they left a level.
+        self._file_serial = 0  # Every spilled file gets a new name, so a file is never rewritten in place.
+        # Saves copy the spilled files on another thread. While any are doing that (pins > 0), files that are no
+        # longer needed go in _unused instead of being deleted.
+        self._files_lock = threading.Lock()
+        self._pins = 0
+        self._unused: List[str] = []
+
+    @property
+    def view_size(self) -> Tuple[int, int]:
+        return self.pipeline.params["view_width"], self.pipeline.params["view_height"]
+
+    def goto(self, depth: int) -> GameMap:
+        """Leave the current level for the level at `depth`, make it the engine's game_map, and return it."""
+        engine = self.engine
+        player = engine.player
+        if self.depth:
+            # Take the player along; the level they leave is kept without them.
+            old_map = engine.game_map
+            self._player_positions[self.depth] = player.map_x, player.map_y
+            old_map.remove_entity(player)
+            self._in_memory[self.depth] = old_map
+            self._in_memory.move_to_end(self.depth)
+
+        game_map = self._in_memory.pop(depth, None)
+        if game_map is None and depth in self._on_disk:
+            game_map = self._load(depth)
+        if game_map is None:
+            # Places the player at the level's start.
+            game_map = self.pipeline.take(depth, engine, use_entity_store=self.use_entity_store)
+        else:
+            player.place(*self._player_positions[depth], game_map)
+            game_map.focus_viewport(player.map_x, player.map_y)
+
+        self.depth = depth
+        engine.game_map = game_map
+        self._evict()
+        engine.update_fov()
+        return game_map
+
+    def descend(self) -> GameMap:
+        return self.goto(self.depth + 1)
+
+    def ascend(self) -> GameMap:
+        return self.goto(max(1, self.depth - 1))
+
+    @property
+    def cached_depths(self) -> Tuple[int, ...]:
+        """Depths held in memory, not counting the current one."""
+        return tuple(self._in_memory)
+
+    @property
+    def in_memory_levels(self) -> Dict[int, GameMap]:
+        """The levels held in memory, not counting the current one."""
+        return dict(self._in_memory)
+
+    def pin_spilled_levels(self) -> Dict[int, str]:
+        """
+        Return the levels written out to cache_dir, and their files. The files are kept on disk, even if the level is
+        loaded back in the meantime, until unpin_spilled_levels() is called. That can be done from any thread.
+        """
+        with self._files_lock:
+            self._pins += 1
+        return dict(self._on_disk)
+
+    def unpin_spilled_levels(self) -> None:
+        with self._files_lock:
+            self._pins -= 1
+            unused, self._unused = (self._unused, []) if self._pins == 0 else ([], self._unused)
+        for path in unused:
+            self._remove_file(path)
+
+    def _discard_file(self, path: str) -> None:
+        with self._files_lock:
+            if self._pins:
+                self._unused.append(path)
+                return
+        self._remove_file(path)
+
+    @staticmethod
+    def _remove_file(path: str) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass  # Already gone, and either way it's only the cache.
+
+    def _new_file_path(self, depth: int) -> str:
+        self._file_serial += 1
+        return os.path.join(self.cache_dir, f"level_{depth}_{self._file_serial}.npz")
+
+    @property
+    def player_positions(self) -> Dict[int, Tuple[int, int]]:
+        return dict(self._player_positions)
+
+    def restore(self, info: SaveInfo) -> None:
+        """
+        Pick up a game loaded with save_game.load_game, whose level at info.depth is already the engine's game_map.
+        The saved levels are copied into cache_dir rather than read, so only the ones the player goes back to are
+        ever loaded, and the save itself can be replaced by the next save.
+        """
+        self.depth = info.depth
+        self._player_positions = dict(info.player_positions)
+        for depth, path in info.level_files.items():
+            self._on_disk[depth] = self._new_file_path(depth)
+            shutil.copyfile(path, self._on_disk[depth])
+
+    def _evict(self) -> None:
+        while len(self._in_memory) > self.max_cached:
+            depth, game_map = self._in_memory.popitem(last=False)
+            path = self._new_file_path(depth)
+            level_io.save_level(path, game_map)
+            self._on_disk[depth] = path
+
+    def _load(self, depth: int) -> GameMap:
+        path = self._on_disk.pop(depth)
+        arrays = level_io.load_level_arrays(path)
+        self._discard_file(path)
+        return level_io.unpack_level(arrays, self.engine, *self.view_size, use_entity_store=self.use_entity_store)
+
+    def close(self) -> None:
+        """
+        Delete the cached level files (and the cache directory, if this manager made it). Saves that are still copying
+        files must be finished first.
+        """
+        for path in [*self._on_disk.values(), *self._unused]:
+            self._remove_file(path)
+        self._on_disk.clear()
+        self._unused.clear()
+        if self._own_cache_dir:
+            shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def __enter__(self) -> LevelManager:
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
@@ -0,0 +1,161 @@
+from __future__ import annotations
+
+import random
+from concurrent.futures import Future
+from typing import Any, Dict, NamedTuple, Optional, TYPE_CHECKING
+
+import numpy as np  # type: ignore
+
+from engine import Engine
+import entity_factories
+from game_map import GameMap
+from procgen import RectangularRoom, generate_dungeon
+
+if TYPE_CHECKING:
+    from concurrent.futures import ProcessPoolExecutor
+
+    from entity import Actor
+
+# Prototypes a generated level can spawn, by name. Spawn specs refer to them by their index in this list.
+SPAWNABLE = [entity_factories.orc, entity_factories.troll]
+SPAWNABLE_INDEX = {prototype.name: index for index, prototype in enumerate(SPAWNABLE)}
+
+spawn_dt = np.dtype(
+    [
+        ("prototype", np.uint8),  # Index into SPAWNABLE.
+        ("x", np.int32),
+        ("y", np.int32),
+    ]
+)
+
+
+class LevelSpec(NamedTuple):
+    """A generated level packed into plain arrays, which are cheap to send back from a worker process."""
+    seed: int
+    map_tiles: np.ndarray  # Tile ids.
+    player_x: int
+    player_y: int
+    spawns: np.ndarray  # spawn_dt records.
+    rooms: np.ndarray  # One (x1, y1, x2, y2) row per room.
+
+
+def level_seed(base_seed: int, depth: int) -> int:
+    """Derive the seed of a dungeon level from the seed of the whole run."""
+    return random.Random(f"{base_seed}:{depth}").getrandbits(32)
+
+
+def generate_level(seed: int, params: Dict[str, Any]) -> LevelSpec:
+    """
+    Generate a level with generate_dungeon and pack it into a LevelSpec. This is what the workers run, or take()
+    itself for small levels.
+
+    params are the keyword arguments for generate_dungeon, minus the engine. A throwaway engine and player are used
+    for the generation; build_level() puts the real ones in later.
+    """
+    engine = Engine(player=entity_factories.player.clone())
+    # A generator of its own rather than the random module, so generating a level never disturbs the game's rolls.
+    dungeon = generate_dungeon(engine=engine, rng=random.Random(seed), **params)
+
+    spawns = np.array(
+        [
+            (SPAWNABLE_INDEX[entity.name], entity.map_x, entity.map_y)
+            for entity in dungeon.entities
+            if entity is not engine.player
+        ],
+        dtype=spawn_dt,
+    )
+    # Sort so the spawn order (and so the entity ids) doesn't depend on set iteration order.
+    spawns.sort(order=["y", "x"])
+    rooms = np.array([(room.x1, room.y1, room.x2, room.y2) for room in dungeon.rooms], dtype=np.int32).reshape(-1, 4)
+    return LevelSpec(seed, np.asarray(dungeon.map_tiles), engine.player.map_x, engine.player.map_y, spawns, rooms)
+
+
+def build_level(
+        spec: LevelSpec, engine: Engine, view_width: int, view_height: int, use_entity_store: bool = False,
+) -> GameMap:
+    """Rebuild the GameMap described by a LevelSpec, with the engine's player placed at the start position."""
+    player: Actor = engine.player
+    map_width, map_height = spec.map_tiles.shape
+    dungeon = GameMap(
+        engine, map_width, map_height, view_width, view_height, entities=[player], use_entity_store=use_entity_store
+    )
+    dungeon.map_tiles[:] = spec.map_tiles
+    dungeon.rooms = [RectangularRoom(x1, y1, x2 - x1, y2 - y1) for x1, y1, x2, y2 in spec.rooms.tolist()]
+
+    player.place(spec.player_x, spec.player_y, dungeon)
+    dungeon.focus_viewport(player.map_x, player.map_y)
+    for prototype, x, y in spec.spawns.tolist():
+        SPAWNABLE[prototype].spawn(dungeon, x, y)
+
+    return dungeon
+
+
+class LevelPipeline:
+    """
+    Hands out dungeon levels, generating the big ones ahead of time in a pool of worker processes.
+
+    Call prefetch(depth) once the player has a way to reach that level (e.g. when they find the stairs down), and
+    take(depth, engine) when the level is actually needed. take() only waits if the worker hasn't finished yet. Levels
+    are generated from level_seed(base_seed, depth), so a run is reproducible from its base seed.
+
+    Levels of up to inline_cells cells are never sent to a worker: they generate in a few milliseconds, far less than
+    it takes to start a worker process and hand the level back, so take() just generates them on the spot. The
+    worker pool (and the multiprocessing machinery behind it) isn't even imported until the first big level is
+    prefetched, so main.py's 80x45 game never starts it. Use this as a context manager (or call close()) so the
+    workers get shut down.
+    """
+
+    def __init__(
+            self,
+            params: Dict[str, Any],
+            base_seed: int,
+            max_workers: Optional[int] = None,
+            inline_cells: int = 200 * 200,
+    ):
+        self.params = params
+        self.base_seed = base_seed
+        self.max_workers = max_workers
+        self.inline_cells = inline_cells
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._pending: Dict[int, Future] = {}
+
+    @property
+    def inline(self) -> bool:
+        """True if levels are small enough to be generated in take() rather than in a worker."""
+        return self.params["map_width"] * self.params["map_height"] <= self.inline_cells
+
+    def prefetch(self, depth: int) -> None:
+        """Start generating a level in a worker, unless it's already on its way or small enough to do inline."""
+        if self.inline or depth in self._pending:
+            return
+        if self._executor is None:
+            # Imported here: it pulls in multiprocessing, which a game of small levels never needs.
+            from concurrent.futures import ProcessPoolExecutor
+
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        self._pending[depth] = self._executor.submit(generate_level, level_seed(self.base_seed, depth), self.params)
+
+    def take(self, depth: int, engine: Engine, use_entity_store: bool = False) -> GameMap:
+        """Return the level at this depth, built for this engine."""
+        future = self._pending.pop(depth, None)
+        if future is not None:
+            spec = future.result()
+        else:
+            spec = generate_level(level_seed(self.base_seed, depth), self.params)
+        return build_level(
+            spec, engine, self.params["view_width"], self.params["view_height"], use_entity_store=use_entity_store
+        )
+
+    def close(self) -> None:
+        for future in self._pending.values():
+            future.cancel()
+        self._pending.clear()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def __enter__(self) -> LevelPipeline:
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
@@ -1,14 +1,64 @@
 #!/usr/bin/env python3
-import copy
+from __future__ import annotations
+
+import time
+
+_LAUNCHED = time.perf_counter()  # Taken before the other imports, so --startup-profile can count them.
+
+import argparse
+import contextlib
+import multiprocessing
+import random
+from typing import ContextManager, List, Optional, Tuple, TYPE_CHECKING
 
 import tcod
 
-from engine import Engine
-import entity_factories
-from procgen import generate_dungeon
+from frame_scheduler import FrameScheduler
+
+if TYPE_CHECKING:
+    from engine import Engine
+    from level_manager import LevelManager
+    from save_game import Autosaver, SaveInfo
+
+
+def print_startup_profile(marks: List[Tuple[str, float]]) -> None:
+    """Print how long each startup step took, given (step, time it finished) pairs in order."""
+    previous = _LAUNCHED
+    for step, finished in marks:
+        print(f"{step:<14}{(finished - previous) * 1000:8.1f} ms")
+        previous = finished
+    print(f"{'total':<14}{(previous - _LAUNCHED) * 1000:8.1f} ms")
+
+
+def start_autosaver(
+        engine: Engine, save_path: str, every: int, level_manager: LevelManager, save_info: Optional[SaveInfo],
+        recording: bool,
+) -> ContextManager[Optional[Autosaver]]:
+    """
+    Return the autosaver for this session, to use in a with statement. A recording run gets none: it starts a new
+    game on purpose, and autosaving that would replace the player's real save.
+    """
+    if recording:
+        return contextlib.nullcontext()
+    from save_game import Autosaver
+
+    return Autosaver(
+        engine, save_path, every=every, level_manager=level_manager,
+        keep=[save_info.directory] if save_info else [],
+    )
 
 
 def main() -> None:
+    parser = argparse.ArgumentParser(description="Roguelike Tutorial 2021")
+    parser.add_argument(
+        "--record", metavar="PATH", help="Record every action to this file, for replay.py. Always starts a new game.",
+    )
+    parser.add_argument(
+        "--startup-profile", action="store_true", help="Print how long each step took up to the first frame.",
+    )
+    args = parser.parse_args()
+    marks = [("imports", time.perf_counter())]
+
     screen_columns = 80
     screen_rows = 50
     screen_width = int(screen_columns*10*1.5)
@@ -26,28 +76,18 @@ def main() -> None:
 
     max_monsters_per_room = 2
 
+    max_fps = 60
+
+    save_path = "savegame"
+    autosave_every = 50  # Turns.
+
     tileset = tcod.tileset.load_tilesheet(
         "dejavu10x10_gs_tc.png", 32, 8, tcod.tileset.CHARMAP_TCOD
     )
+    marks.append(("tileset", time.perf_counter()))
 
     player_color = (255, 255, 255)
     npc_color = (255, 255, 0)
-    player = copy.deepcopy(entity_factories.player)
-
-    engine = Engine(player=player)
-
-    engine.game_map = generate_dungeon(
-        max_rooms=max_rooms,
-        room_min_size=room_min_size,
-        room_max_size=room_max_size,
-        map_width=map_width,
-        map_height=map_height,
-        view_width=view_width,
-        view_height=view_height,
-        max_monsters_per_room=max_monsters_per_room,
-        engine=engine,
-    )
-    engine.update_fov()
 
     with tcod.context.new(
         width=screen_width,
@@ -56,12 +96,66 @@ def main() -> None:
         title="Roguelike Tutorial 2021",
         vsync=True
     ) as context:
-        root_console = tcod.Console(screen_columns, screen_rows, order="F")
-        while True:
+        marks.append(("window", time.perf_counter()))
+
+        # The game itself is only imported once the window is up, so the window appears as early as possible.
+        from engine import Engine
+        import entity_factories
+        from level_manager import LevelManager
+        from level_pipeline import LevelPipeline
+        from save_game import current_save, load_game
+        marks.append(("game imports", time.perf_counter()))
+
+        # Carry on from the autosave if there is one. Only the current level is read now, and that's memory-mapped.
+        engine, save_info = None, None
+        if not args.record and current_save(save_path):
+            engine, save_info = load_game(save_path, view_width, view_height)
+        else:
+            engine = Engine(player=entity_factories.player.clone())
+        seed = save_info.base_seed if save_info else random.randrange(2**32)
+        marks.append(("load save", time.perf_counter()))
+
+        with LevelPipeline(
+            params=dict(
+                max_rooms=max_rooms,
+                room_min_size=room_min_size,
+                room_max_size=room_max_size,
+                map_width=map_width,
+                map_height=map_height,
+                view_width=view_width,
+                view_height=view_height,
+                max_monsters_per_room=max_monsters_per_room,
+            ),
+            base_seed=seed,
+        ) as levels, LevelManager(engine, levels) as level_manager, start_autosaver(
+            engine, save_path, autosave_every, level_manager, save_info, recording=bool(args.record),
+        ) as autosaver:
+            if save_info:
+                level_manager.restore(save_info)
+            else:
+                level_manager.goto(1)
+            marks.append(("first level", time.perf_counter()))
+            engine.autosaver = autosaver
+            if args.record:
+                from replay import ReplayRecorder  # Only needed when recording.
+
+                engine.recorder = ReplayRecorder(
+                    args.record, seed=seed, builder="pipeline", params=levels.params, engine=engine
+                )
+
+            root_console = tcod.Console(screen_columns, screen_rows, order="F")
             engine.render(console=root_console, context=context)
-
-            engine.event_handler.handle_events()
-
+            marks.append(("first frame", time.perf_counter()))
+            if args.startup_profile:
+                print_startup_profile(marks)
+            try:
+                FrameScheduler(engine, root_console, context, max_fps=max_fps).run()
+            finally:
+                if engine.recorder is not None:
+                    engine.recorder.close()
+                if engine.path_service is not None:
+                    engine.path_service.close()
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()  # Needed for the level pipeline's worker processes in PyInstaller builds.
     main()
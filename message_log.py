@@ -0,0 +1,105 @@
+from __future__ import annotations
+
+from collections import deque
+import itertools
+import queue
+import threading
+from typing import Deque, Iterator, NamedTuple, Optional, TextIO, Tuple
+
+from tcod.console import Console
+
+KIND_COLORS = {
+    "attack": (224, 224, 224),
+    "death": (255, 160, 48),
+    "player_death": (255, 48, 48),
+    "autosave_failed": (255, 255, 0),
+}
+
+
+class Message(NamedTuple):
+    """
+    One entry in the message log. Only the facts are stored; the text is put together when something actually reads
+    it, which most messages never are.
+    """
+    turn: int
+    kind: str  # "attack", "death", "player_death" or "autosave_failed".
+    actor: str
+    target: str = ""
+    amount: int = 0
+
+    @property
+    def text(self) -> str:
+        if self.kind == "attack":
+            attack_desc = f"{self.actor.capitalize()} attacks {self.target}"
+            if self.amount > 0:
+                return f"{attack_desc} for {self.amount} hit points."
+            return f"{attack_desc} but does no damage"
+        if self.kind == "player_death":
+            return "You died!"
+        if self.kind == "death":
+            return f"{self.actor} is dead!"
+        if self.kind == "autosave_failed":
+            return f"Autosave failed: {self.actor}"
+        return f"{self.actor}: {self.kind}"
+
+    @property
+    def color(self) -> Tuple[int, int, int]:
+        return KIND_COLORS.get(self.kind, (255, 255, 255))
+
+
+class MessageLog:
+    """
+    Fixed-size ring buffer of the most recent messages.
+
+    Adding a message is just an append to a deque, so it's fine to call from the action path. If sink_path is given,
+    every message is also handed to a background thread that writes it to that file as a tab separated line, so the
+    game never waits on the disk. Call close() to flush the sink and stop the thread.
+    """
+
+    def __init__(self, capacity: int = 1000, sink_path: Optional[str] = None):
+        self.messages: Deque[Message] = deque(maxlen=capacity)
+        self._sink: Optional[queue.SimpleQueue] = None
+        self._sink_thread: Optional[threading.Thread] = None
+        if sink_path is not None:
+            self._sink = queue.SimpleQueue()
+            self._sink_thread = threading.Thread(
+                target=self._write_sink, args=(open(sink_path, "w", encoding="utf-8"),), daemon=True,
+            )
+            self._sink_thread.start()
+
+    def add(self, turn: int, kind: str, actor: str, target: str = "", amount: int = 0) -> None:
+        message = Message(turn, kind, actor, target, amount)
+        self.messages.append(message)
+        if self._sink is not None:
+            self._sink.put(message)
+
+    def __iter__(self) -> Iterator[Message]:
+        return iter(self.messages)
+
+    def __len__(self) -> int:
+        return len(self.messages)
+
+    def _write_sink(self, file: TextIO) -> None:
+        with file:
+            file.write("turn\tkind\tactor\ttarget\tamount\ttext\n")
+            while True:
+                message = self._sink.get()
+                if message is None:
+                    break
+                file.write("\t".join(map(str, message)) + f"\t{message.text}\n")
+
+    def close(self) -> None:
+        """Write out whatever the sink still has queued and wait for its thread to finish."""
+        if self._sink_thread is not None:
+            self._sink.put(None)
+            self._sink_thread.join()
+            self._sink_thread = None
+            self._sink = None
+
+    def render(self, console: Console, x: int, y: int, width: int, height: int) -> None:
+        """Print the newest messages that fit in the given box, oldest at the top, cut off at the box's width."""
+        if height <= 0:
+            return
+        newest = list(itertools.islice(reversed(self.messages), height))
+        for line, message in enumerate(reversed(newest)):
+            console.print(x=x, y=y + line, string=message.text[:width], fg=message.color)
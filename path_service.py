@@ -0,0 +1,117 @@
+from __future__ import annotations
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import os
+from typing import List, Optional, Tuple, TYPE_CHECKING
+
+import numpy as np  # type: ignore
+
+from components.ai import find_path, path_cost
+
+if TYPE_CHECKING:
+    from engine import Engine
+    from entity import Actor
+
+Box = Tuple[int, int, int, int]  # (x0, y0, x1, y1)
+# (actor, start, goal, path window)
+PathRequest = Tuple["Actor", Tuple[int, int], Tuple[int, int], Box]
+
+
+def _area(box: Box) -> int:
+    return (box[2] - box[0]) * (box[3] - box[1])
+
+
+def cluster_windows(windows: List[Box], slack: float = 2.0) -> List[Tuple[Box, List[int]]]:
+    """
+    Group path windows that can share a cost grid, and return (bounding box, indexes into windows) per group.
+
+    A window joins the first group whose bounding box would stay at most `slack` times the area of the windows in
+    it, so a grid never covers much more than the windows need. On a plain GameMap every window is the whole map and
+    they all end up in one group. On a ChunkedGameMap, enemies on opposite sides of the world get a grid each,
+    instead of one that loads every chunk in between.
+    """
+    groups: List[Tuple[Box, int, List[int]]] = []  # (bounding box, total window area, indexes)
+    for index, window in enumerate(windows):
+        for number, (box, area, members) in enumerate(groups):
+            merged = (
+                min(box[0], window[0]), min(box[1], window[1]), max(box[2], window[2]), max(box[3], window[3])
+            )
+            if _area(merged) <= slack * (area + _area(window)):
+                members.append(index)
+                groups[number] = (merged, area + _area(window), members)
+                break
+        else:
+            groups.append((window, _area(window), [index]))
+    return [(box, members) for box, _, members in groups]
+
+
+class PathService:
+    """
+    Works out, before a round of enemy turns, every path the enemies in it are going to need, all at once.
+
+    Each AI is asked for the goal it will head for (BaseAI.path_request) and whether its cached path still does
+    (BaseAI.update_path). Requests whose path windows lie close together share one cost grid, built once for the box
+    around them (see cluster_windows), then the paths are solved side by side in a thread pool: tcod's pathfinder runs
+    in C without the GIL, so this uses as many cores as there are workers. The paths are handed back to the AIs in
+    round order, so when step_toward runs on their turn the path is already there.
+
+    All paths are solved against the map as it is at the start of the round, rather than after the enemies before
+    them in the round have moved. The result only depends on the game state, never on thread timing, so games
+    (and replays) stay deterministic. Anyone who steps into a path later gets routed around by repair_path as usual.
+    """
+
+    def __init__(self, engine: Engine, max_workers: Optional[int] = None, min_parallel: int = 8):
+        self.engine = engine
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.min_parallel = min_parallel  # Fewer requests than this are solved on the main thread.
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.solved = 0  # Paths solved so far, for benchmarks.
+
+    def collect(self, enemies: List[Actor]) -> List[PathRequest]:
+        """The path requests for this round, in round order."""
+        game_map = self.engine.game_map
+        requests: List[PathRequest] = []
+        for enemy in enemies:
+            ai = enemy.ai
+            goal = ai.path_request()
+            if goal is not None and ai.update_path(*goal):
+                start = enemy.map_x, enemy.map_y
+                requests.append((enemy, start, goal, game_map.path_window(*start, *goal)))
+        return requests
+
+    def prepare_round(self, enemies: List[Actor]) -> None:
+        requests = self.collect(enemies)
+        if not requests:
+            return
+
+        # One cost grid per group of nearby windows, and each request's (grid, grid origin) by request index.
+        game_map = self.engine.game_map
+        grids: List[Optional[Tuple[np.ndarray, int, int]]] = [None] * len(requests)
+        for (x0, y0, x1, y1), members in cluster_windows([window for *_, window in requests]):
+            grid = path_cost(game_map, x0, y0, x1, y1), x0, y0
+            for index in members:
+                grids[index] = grid
+
+        def solve(index: int) -> List[Tuple[int, int]]:
+            _, start, goal, (wx0, wy0, wx1, wy1) = requests[index]
+            cost, x0, y0 = grids[index]
+            return find_path(cost[wx0 - x0:wx1 - x0, wy0 - y0:wy1 - y0], wx0, wy0, start, goal)
+
+        if len(requests) < self.min_parallel or self.max_workers == 1:
+            paths = [solve(index) for index in range(len(requests))]
+        else:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="paths")
+            paths = list(self._executor.map(solve, range(len(requests))))  # map() keeps the request order.
+
+        profiler = self.engine.profiler
+        for (enemy, *_), path in zip(requests, paths):
+            profiler.count_path_call(type(enemy.ai).__name__)
+            enemy.ai.path = deque(path)
+        self.solved += len(requests)
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
@@ -1,10 +1,11 @@
 from __future__ import annotations
 
-from typing import Iterator, Tuple, List, TYPE_CHECKING
+from typing import Callable, Tuple, List, Optional, TYPE_CHECKING
 import random
 
-import tcod
+import numpy as np  # type: ignore
 
+from chunked_map import ChunkedGameMap
 import entity_factories
 from game_map import GameMap
 import tile_types
@@ -42,38 +43,44 @@ class RectangularRoom:
         )
 
 def place_entities(
-        room: RectangularRoom, dungeon: GameMap, maximum_monsters: int,
+        room: RectangularRoom, dungeon: GameMap, maximum_monsters: int, rng: Optional[random.Random] = None,
 ) -> None:
-    number_of_monsters = random.randint(0, maximum_monsters)
+    rng = rng or random  # The random module itself works fine as the default generator.
+    number_of_monsters = rng.randint(0, maximum_monsters)
 
     for i in range(number_of_monsters):
-        x = random.randint(room.x1 + 1, room.x2 - 1)
-        y = random.randint(room.y1 + 1, room.y2 - 1)
+        x = rng.randint(room.x1 + 1, room.x2 - 1)
+        y = rng.randint(room.y1 + 1, room.y2 - 1)
 
-        if not any(entity.map_x == x and entity.map_y == y for entity in dungeon.entities):
-            if random.random() < 0.8:
+        if not dungeon.get_blocking_entity_at_location(x, y):
+            if rng.random() < 0.8:
                 entity_factories.orc.spawn(dungeon, x, y)
             else:
                 entity_factories.troll.spawn(dungeon, x, y)
 
 def tunnel_between(
-        start: Tuple[int, int], end: Tuple[int, int]
-) -> Iterator[Tuple[int, int]]:
-    """Return an L shaped tunnel between these two points."""
+        start: Tuple[int, int], end: Tuple[int, int], rng: Optional[random.Random] = None,
+) -> List[Tuple[slice, slice]]:
+    """
+    Return an L shaped tunnel between these two points.
+
+    The tunnel is returned as the two (x, y) slices that cover its legs, so each leg can be carved into map_tiles in
+    one go. Both legs are straight lines, so these are exactly the cells tcod.los.bresenham would have given.
+    """
+    rng = rng or random
     x1, y1 = start
     x2, y2 = end
-    if random.random() < 0.5:  # 50% chance
+    if rng.random() < 0.5:  # 50% chance
         # Move horizontally, then vertically
         corner_x, corner_y = x2, y1
     else:
         # Move vertically, then horizontally
         corner_x, corner_y = x1, y2
 
-    # Generate the coordinates for this tunnel.
-    for x, y in tcod.los.bresenham((x1, y1), (corner_x, corner_y)).tolist():
-        yield x, y
-    for x, y in tcod.los.bresenham((corner_x, corner_y), (x2, y2)).tolist():
-        yield x, y
+    return [
+        (slice(min(x1, corner_x), max(x1, corner_x) + 1), slice(min(y1, corner_y), max(y1, corner_y) + 1)),
+        (slice(min(corner_x, x2), max(corner_x, x2) + 1), slice(min(corner_y, y2), max(corner_y, y2) + 1)),
+    ]
 
 
 def generate_dungeon(
@@ -86,27 +93,37 @@ def generate_dungeon(
         view_height: int,
         max_monsters_per_room: int,
         engine: Engine,
+        use_entity_store: bool = False,
+        rng: Optional[random.Random] = None,
 ) -> GameMap:
-    """Generate a new dungeon map."""
+    """Generate a new dungeon map. Random numbers come from rng if given, or else the random module."""
+    rng = rng or random
     player = engine.player
-    dungeon = GameMap(engine, map_width, map_height, view_width, view_height, entities=[player])
+    dungeon = GameMap(
+        engine, map_width, map_height, view_width, view_height, entities=[player], use_entity_store=use_entity_store
+    )
 
-    rooms: List[RectangularRoom] = []
+    rooms: List[RectangularRoom] = dungeon.rooms
+    # Every cell covered by an accepted room, edges included. A new room intersects an old one (by the same rule as
+    # RectangularRoom.intersects) exactly when any cell under it is already taken.
+    occupied = np.zeros((dungeon.map_width, dungeon.map_height), dtype=bool, order="F")
 
     for r in range(max_rooms):
-        room_width = random.randint(room_min_size, room_max_size)
-        room_height = random.randint(room_min_size, room_max_size)
+        room_width = rng.randint(room_min_size, room_max_size)
+        room_height = rng.randint(room_min_size, room_max_size)
 
-        x = random.randint(dungeon.buffer_x, dungeon.map_width - dungeon.buffer_x - room_width - 1)
-        y = random.randint(dungeon.buffer_y, dungeon.map_height - dungeon.buffer_y - room_height - 1)
+        x = rng.randint(0, dungeon.map_width - room_width - 1)
+        y = rng.randint(0, dungeon.map_height - room_height - 1)
 
         # "RectangularRoom" class makes rectangles easier to work with
         new_room = RectangularRoom(x, y, room_width, room_height)
 
-        # Run through the other rooms and see if they intersect with this one.
-        if any(new_room.intersects(other_room) for other_room in rooms):
+        # Check the occupancy mask to see if any other room intersects with this one.
+        room_area = slice(new_room.x1, new_room.x2 + 1), slice(new_room.y1, new_room.y2 + 1)
+        if occupied[room_area].any():
             continue  # This room intersections, so go to the next attempt
         # If there are no intersections then the room is valid.
+        occupied[room_area] = True
 
         # Dig out this room's inner area.
         dungeon.map_tiles[new_room.inner] = tile_types.floor
@@ -118,12 +135,89 @@ def generate_dungeon(
             dungeon.focus_viewport(player.map_x, player.map_y)
         else:  # All rooms after the first.
             # Dig out a tunnel between this room and the previous one.
-            for x, y in tunnel_between(rooms[-1].center, new_room.center):
-                dungeon.map_tiles[x, y] = tile_types.floor
+            for leg in tunnel_between(rooms[-1].center, new_room.center, rng):
+                dungeon.map_tiles[leg] = tile_types.floor
 
         # Place entities into room:
-        place_entities(new_room, dungeon, max_monsters_per_room)
+        place_entities(new_room, dungeon, max_monsters_per_room, rng)
         # Finally, append the new room to the list.
         rooms.append(new_room)
 
+    dungeon.invalidate_render_cache()  # The viewport was focused before the later rooms were dug.
+    return dungeon
+
+
+def chunk_generator(
+        seed: int, room_min_size: int, room_max_size: int, max_monsters_per_room: int,
+) -> Callable[[ChunkedGameMap, int, int, np.ndarray], None]:
+    """
+    Return a procgen hook for ChunkedGameMap.
+
+    Every chunk gets a cross of corridors through its middle, which lines up with the corridors of the neighbouring
+    chunks so the whole world stays connected, plus one room tunnelled to that crossing. Each chunk is seeded from
+    (seed, chunk_x, chunk_y), so it comes out the same no matter what order chunks are generated in. Chunks that
+    hang off the edge of the world are left as solid wall.
+    """
+    def generate_chunk(dungeon: ChunkedGameMap, chunk_x: int, chunk_y: int, tiles: np.ndarray) -> None:
+        size = tiles.shape[0]
+        origin_x, origin_y = chunk_x * size, chunk_y * size
+        if origin_x + size > dungeon.map_width or origin_y + size > dungeon.map_height:
+            return
+
+        rng = random.Random(f"{seed}:{chunk_x}:{chunk_y}")
+        middle = size // 2
+        tiles[:, middle] = tile_types.floor
+        tiles[middle, :] = tile_types.floor
+
+        room_width = rng.randint(room_min_size, min(room_max_size, size - 2))
+        room_height = rng.randint(room_min_size, min(room_max_size, size - 2))
+        room = RectangularRoom(
+            rng.randint(0, size - room_width - 1), rng.randint(0, size - room_height - 1), room_width, room_height
+        )
+        tiles[room.inner] = tile_types.floor
+
+        # L shaped tunnel from the room to the corridor crossing.
+        center_x, center_y = room.center
+        tiles[min(center_x, middle):max(center_x, middle) + 1, center_y] = tile_types.floor
+        tiles[middle, min(center_y, middle):max(center_y, middle) + 1] = tile_types.floor
+
+        world_room = RectangularRoom(origin_x + room.x1, origin_y + room.y1, room_width, room_height)
+        place_entities(world_room, dungeon, max_monsters_per_room, rng)
+
+    return generate_chunk
+
+
+def generate_chunked_world(
+        world_width: int,
+        world_height: int,
+        view_width: int,
+        view_height: int,
+        room_min_size: int,
+        room_max_size: int,
+        max_monsters_per_room: int,
+        engine: Engine,
+        seed: int,
+        chunk_size: int = 64,
+        spill_dir: Optional[str] = None,
+        use_entity_store: bool = False,
+) -> ChunkedGameMap:
+    """
+    Create a lazily generated world. Nothing is generated up front: chunks are built the first time the viewport,
+    FOV or pathfinding reaches them. The player starts on the corridor crossing of the middle chunk, so the world
+    should be at least a few chunks wide.
+    """
+    player = engine.player
+    dungeon = ChunkedGameMap(
+        engine, world_width, world_height, view_width, view_height, entities=[player],
+        use_entity_store=use_entity_store,
+        generate_chunk=chunk_generator(seed, room_min_size, room_max_size, max_monsters_per_room),
+        chunk_size=chunk_size,
+        spill_dir=spill_dir,
+    )
+
+    start_x = dungeon.map_width // 2 // chunk_size * chunk_size + chunk_size // 2
+    start_y = dungeon.map_height // 2 // chunk_size * chunk_size + chunk_size // 2
+    player.place(start_x, start_y, dungeon)
+    dungeon.focus_viewport(player.map_x, player.map_y)
+
     return dungeon
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+Recording the player's actions and playing them back.
+
+A replay file is a small header followed by three bytes per turn:
+
+    magic    b"RLRP"
+    header   version (uint16), seed (uint64), length of the JSON that follows (uint32)
+    JSON     how the level was built: {"builder": "pipeline" or "headless", "params": {...}}
+    records  action_dt records: action type, dx, dy
+    trailer  optional: a 0xFF byte and the sha256 state_digest() of the game when recording stopped
+
+The game is deterministic given its level, so rebuilding the level from the seed and performing the same actions
+reproduces the game exactly; if the file has a trailer the replay checks that it does. Replays run without a window,
+as fast as the engine goes, so a slow turn from a real session can be profiled with --profile-csv. Example:
+
+    python replay.py session.rpl --render-every 10 --profile-csv slow_turns.csv
+"""
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import struct
+import time
+from typing import Any, BinaryIO, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np  # type: ignore
+import tcod
+
+from actions import Action, ActionWithDirection, BumpAction, MeleeAction, MovementAction, WaitAction
+from engine import Engine
+import entity_factories
+from input_handlers import MainGameEventHandler
+import level_io
+from level_pipeline import build_level, generate_level, level_seed
+
+MAGIC = b"RLRP"
+REPLAY_VERSION = 2  # 2: enemy paths are solved at the start of each round (PathService), which changes games.
+_HEADER = struct.Struct("<HQI")
+END_MARKER = 0xFF
+
+# Recorded action types by their code. Anything else (EscapeAction) isn't part of the game state, so isn't recorded.
+ACTION_TYPES = [WaitAction, BumpAction, MovementAction, MeleeAction]
+ACTION_CODES = {action_type: code for code, action_type in enumerate(ACTION_TYPES)}
+
+action_dt = np.dtype(
+    [
+        ("action", np.uint8),  # Index into ACTION_TYPES.
+        ("dx", np.int8),
+        ("dy", np.int8),
+    ]
+)
+
+
+def state_digest(engine: Engine) -> bytes:
+    """A sha256 of everything a turn can change: tiles, explored and visible, every entity, and the turn count."""
+    game_map = engine.game_map
+    digest = hashlib.sha256()
+    digest.update(struct.pack("<Q", engine.turn))
+    for array in (game_map.map_tiles, game_map.explored, game_map.visible):
+        digest.update(np.ascontiguousarray(array).tobytes())
+    digest.update(level_io.pack_entities(game_map).tobytes())
+    return digest.digest()
+
+
+class ReplayRecorder:
+    """
+    Appends each action handed to record() to a replay file. Set it as engine.recorder and the main event handler
+    does that for every action the player takes.
+
+    On close() the digest of the engine's state is written after the records, so a replay can check it ended up in
+    the same place. Writes go through the file's buffer and are flushed every `flush_every` turns, so a crash loses
+    at most that many turns.
+    """
+
+    def __init__(
+            self, path: str, seed: int, builder: str, params: Dict[str, Any], engine: Engine, flush_every: int = 100,
+    ):
+        self.engine = engine
+        self.flush_every = flush_every
+        self.count = 0
+        self._file: Optional[BinaryIO] = open(path, "wb")
+        header = json.dumps({"builder": builder, "params": params}).encode()
+        self._file.write(MAGIC + _HEADER.pack(REPLAY_VERSION, seed, len(header)) + header)
+
+    def record(self, action: Action) -> None:
+        code = ACTION_CODES.get(type(action))
+        if code is None or self._file is None:
+            return
+        if isinstance(action, ActionWithDirection):
+            self._file.write(struct.pack("<Bbb", code, action.dx, action.dy))
+        else:
+            self._file.write(struct.pack("<Bbb", code, 0, 0))
+        self.count += 1
+        if self.count % self.flush_every == 0:
+            self._file.flush()
+
+    def close(self) -> None:
+        if self._file is None:
+            return
+        self._file.write(bytes([END_MARKER]) + state_digest(self.engine))
+        self._file.close()
+        self._file = None
+
+    def __enter__(self) -> ReplayRecorder:
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+
+class Replay(NamedTuple):
+    seed: int
+    builder: str
+    params: Dict[str, Any]
+    actions: np.ndarray  # action_dt records.
+    digest: Optional[bytes]  # None if the recording didn't get to close, e.g. after a crash.
+
+
+def load_replay(path: str) -> Replay:
+    with open(path, "rb") as file:
+        data = file.read()
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError(f"{path} is not a replay file")
+    offset = len(MAGIC)
+    version, seed, header_size = _HEADER.unpack_from(data, offset)
+    if version != REPLAY_VERSION:
+        raise ValueError(f"Unsupported replay version {version} in {path}")
+    offset += _HEADER.size
+    header = json.loads(data[offset:offset + header_size])
+    body = data[offset + header_size:]
+
+    # The trailer is 33 bytes, a whole number of records, so the body can be read as records before looking for it.
+    # A crash can leave a partial record at the end, which is dropped.
+    records = np.frombuffer(body[:len(body) - len(body) % action_dt.itemsize], dtype=action_dt)
+    digest = None
+    end = np.flatnonzero(records["action"] == END_MARKER)
+    if end.size:
+        trailer = body[end[0] * action_dt.itemsize:]
+        records = records[:end[0]]
+        digest = trailer[1:]
+    return Replay(seed, header["builder"], header["params"], records, digest)
+
+
+def build_engine(replay: Replay) -> Engine:
+    """Rebuild the game a replay was recorded from, as it was before the first action."""
+    if replay.builder == "headless":
+        from headless import new_engine  # headless imports this module for --record.
+
+        return new_engine(seed=replay.seed, **replay.params)
+
+    # The "pipeline" builder is main.py's: level 1 of a LevelPipeline run with this base seed.
+    params = replay.params
+    engine = Engine(player=entity_factories.player.clone())
+    spec = generate_level(level_seed(replay.seed, 1), params)
+    engine.game_map = build_level(spec, engine, params["view_width"], params["view_height"])
+    engine.update_fov()
+    return engine
+
+
+def decode_actions(engine: Engine, actions: np.ndarray) -> List[Action]:
+    player = engine.player
+    decoded: List[Action] = []
+    for code, dx, dy in actions.tolist():
+        action_type = ACTION_TYPES[code]
+        if issubclass(action_type, ActionWithDirection):
+            decoded.append(action_type(player, dx, dy))
+        else:
+            decoded.append(action_type(player))
+    return decoded
+
+
+def play(
+        engine: Engine, replay: Replay, render_every: int = 0, console_size: Tuple[int, int] = (80, 50),
+) -> int:
+    """
+    Perform a replay's actions on an engine built by build_engine(), and return how many turns were played.
+
+    With render_every=K every Kth turn is also drawn, to an offscreen console, so rendering costs show up in the
+    profile too. 0 means no rendering at all.
+    """
+    console = tcod.Console(*console_size, order="F") if render_every else None
+    played = 0
+    for action in decode_actions(engine, replay.actions):
+        handler = engine.event_handler
+        if not isinstance(handler, MainGameEventHandler):
+            break  # The player died, which is where the recording stopped too.
+        handler.handle_action(action)
+        played += 1
+        if console is not None and played % render_every == 0:
+            with engine.profiler.phase("render"):
+                engine.draw(console)
+            engine.profiler.end_frame()
+            console.clear()
+    return played
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Play back a recorded game without a window.")
+    parser.add_argument("replay", help="A file recorded with main.py --record or headless.py --record.")
+    parser.add_argument("--render-every", type=int, default=0, metavar="K", help="Draw every Kth turn offscreen.")
+    parser.add_argument("--profile-csv", help="Time each phase of every turn and write the results to this CSV file.")
+    args = parser.parse_args()
+
+    replay = load_replay(args.replay)
+    engine = build_engine(replay)
+    engine.profiler.enabled = bool(args.profile_csv)
+
+    start = time.perf_counter()
+    try:
+        played = play(engine, replay, render_every=args.render_every)
+    finally:
+        if engine.path_service is not None:
+            engine.path_service.close()
+    elapsed = time.perf_counter() - start
+    if args.profile_csv:
+        engine.profiler.export_csv(args.profile_csv)
+
+    print(
+        f"Replayed {played} of {len(replay.actions)} turns in {elapsed:.3f}s "
+        f"({played / max(elapsed, 1e-9):.1f} turns/s)"
+    )
+    digest = state_digest(engine)
+    print(f"State digest: {digest.hex()}")
+    if replay.digest is None:
+        print("The recording has no final digest to compare against.")
+    elif digest == replay.digest:
+        print("Matches the recorded game.")
+    else:
+        raise SystemExit("Does NOT match the recorded game.")
+
+
+if __name__ == "__main__":
+    main()
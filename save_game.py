@@ -0,0 +1,271 @@
+"""
+Saving and loading a game without pickling anything.
+
+The save path is a directory holding a file named CURRENT and one or more saves. CURRENT names the newest complete
+save, which is itself a directory:
+
+    meta.json       turn, depth, base seed, where the player was on each level they left
+    player.npy      the player as a single level_io.entity_dt record
+    level_<N>/      the current level as raw .npy files (map_tiles, explored, rooms, entities)
+    level_<N>.npz   every other visited level, compressed
+
+The current level is kept uncompressed so load_game can memory-map its tile arrays (copy-on-write) instead of reading
+and copying them. The other levels aren't needed until the player goes back to them, so they can be small instead.
+
+Saving is split in two: snapshot() copies what's needed on the main thread, which is only a few array copies and the
+packing of the entity tables, and write_snapshot() does all the file work, which can run on another thread. Every save
+is written to a new directory, and CURRENT is only switched to it once it's complete, so a crash halfway through a
+write leaves the previous save as it was. Older saves are deleted after that, except the one the running game was
+loaded from: its files are still memory-mapped, and on Windows a mapped file can't be deleted or moved.
+"""
+from __future__ import annotations
+
+from concurrent.futures import Future, ThreadPoolExecutor
+import json
+import os
+import shutil
+from typing import Any, Callable, Collection, Dict, List, NamedTuple, Optional, Tuple, TYPE_CHECKING
+
+import numpy as np  # type: ignore
+
+from engine import Engine
+import level_io
+
+if TYPE_CHECKING:
+    from level_manager import LevelManager
+
+SAVE_VERSION = 2
+CURRENT = "CURRENT"
+
+
+class Snapshot(NamedTuple):
+    meta: dict
+    player: np.ndarray  # One entity_dt record.
+    current: Dict[str, np.ndarray]  # The packed current level, with copies of its tile arrays.
+    others: Dict[int, Dict[str, np.ndarray]]  # Packed levels the level manager has in memory.
+    spilled: Dict[int, str]  # Level files the level manager has written out, pinned until the save has copied them.
+    release: Optional[Callable[[], None]]  # Unpins the spilled files.
+
+
+class SaveInfo(NamedTuple):
+    """What load_game hands back besides the engine, for restoring a LevelManager."""
+    directory: str  # The save that was loaded. The game has files in it memory-mapped.
+    depth: int
+    base_seed: Optional[int]
+    player_positions: Dict[int, Tuple[int, int]]
+    level_files: Dict[int, str]  # Compressed levels other than the current one, by depth.
+
+
+def _link_or_copy(source: str, destination: str) -> None:
+    try:
+        os.link(source, destination)
+    except OSError:  # Another file system, or no hard links at all.
+        shutil.copyfile(source, destination)
+
+
+def current_save(path: str) -> Optional[str]:
+    """Return the directory of the newest complete save at `path`, or None if there isn't one."""
+    try:
+        with open(os.path.join(path, CURRENT)) as file:
+            name = file.read().strip()
+    except OSError:
+        return None
+    directory = os.path.join(path, name)
+    return directory if os.path.exists(os.path.join(directory, "meta.json")) else None
+
+
+def snapshot(engine: Engine, level_manager: Optional[LevelManager] = None) -> Snapshot:
+    """
+    Capture the state of the game for a save. This has to run on the main thread, between turns, and doesn't touch
+    the disk. The level manager's spilled level files are pinned so it keeps them until write_snapshot has copied them.
+    """
+    player = engine.player
+    current = level_io.pack_level(engine.game_map, exclude=player)
+    current["map_tiles"] = current["map_tiles"].copy()
+    current["explored"] = current["explored"].copy()
+
+    meta = {"version": SAVE_VERSION, "turn": engine.turn, "depth": 0, "base_seed": None, "player_positions": {}}
+    others: Dict[int, Dict[str, np.ndarray]] = {}
+    spilled: Dict[int, str] = {}
+    release = None
+
+    if level_manager is not None:
+        meta["depth"] = level_manager.depth
+        meta["base_seed"] = level_manager.pipeline.base_seed
+        meta["player_positions"] = {
+            str(depth): list(position) for depth, position in level_manager.player_positions.items()
+        }
+        for depth, game_map in level_manager.in_memory_levels.items():
+            arrays = level_io.pack_level(game_map)
+            arrays["map_tiles"] = arrays["map_tiles"].copy()
+            arrays["explored"] = arrays["explored"].copy()
+            others[depth] = arrays
+        spilled = level_manager.pin_spilled_levels()
+        release = level_manager.unpin_spilled_levels
+
+    return Snapshot(meta, level_io.pack_entity_list([player]), current, others, spilled, release)
+
+
+def _new_save_name(path: str) -> str:
+    numbers = [int(name[len("save_"):]) for name in os.listdir(path) if name.startswith("save_") and name[5:].isdigit()]
+    return f"save_{max(numbers, default=0) + 1:06d}"
+
+
+def write_snapshot(snapshot: Snapshot, path: str, keep: Collection[str] = ()) -> None:
+    """
+    Write a snapshot out as a new save at `path` and make it the current one. Safe to run on any thread.
+
+    Older saves are deleted afterwards, apart from the directories in `keep` (full paths).
+    """
+    try:
+        os.makedirs(path, exist_ok=True)
+        name = _new_save_name(path)
+        staging_dir = os.path.join(path, f"{name}.tmp")
+        os.makedirs(staging_dir)
+
+        meta = dict(snapshot.meta)
+        meta["current"] = f"level_{meta['depth']}"
+        meta["levels"] = {}
+        for depth, level_path in snapshot.spilled.items():
+            meta["levels"][str(depth)] = f"level_{depth}.npz"
+            _link_or_copy(level_path, os.path.join(staging_dir, meta["levels"][str(depth)]))
+    finally:
+        if snapshot.release is not None:
+            snapshot.release()
+
+    np.save(os.path.join(staging_dir, "player.npy"), snapshot.player)
+    level_io.write_level_arrays(os.path.join(staging_dir, meta["current"]), snapshot.current)
+    for depth, arrays in snapshot.others.items():
+        meta["levels"][str(depth)] = f"level_{depth}.npz"
+        level_io.write_level_arrays(os.path.join(staging_dir, meta["levels"][str(depth)]), arrays, compress=True)
+    with open(os.path.join(staging_dir, "meta.json"), "w") as file:
+        json.dump(meta, file)
+    os.replace(staging_dir, os.path.join(path, name))
+
+    # Replacing a small file is atomic, so CURRENT always names a complete save.
+    with open(os.path.join(path, f"{CURRENT}.tmp"), "w") as file:
+        file.write(name)
+    os.replace(os.path.join(path, f"{CURRENT}.tmp"), os.path.join(path, CURRENT))
+
+    keep = {os.path.normcase(os.path.abspath(directory)) for directory in keep}
+    for old in os.listdir(path):
+        old_dir = os.path.join(path, old)
+        if (
+                old.startswith("save_") and old != name
+                and os.path.normcase(os.path.abspath(old_dir)) not in keep
+        ):
+            shutil.rmtree(old_dir, ignore_errors=True)
+
+
+def save_game(engine: Engine, path: str, level_manager: Optional[LevelManager] = None) -> None:
+    """Save the game to `path` right away, on this thread."""
+    write_snapshot(snapshot(engine, level_manager), path)
+
+
+def load_game(
+        path: str, view_width: int, view_height: int, use_entity_store: bool = False,
+) -> Tuple[Engine, SaveInfo]:
+    """
+    Load the current save at `path` into a new Engine, with the current level as its game_map and the player placed
+    on it.
+
+    The level's tile arrays are memory-mapped copy-on-write, so they're read from disk as they're touched, and changes
+    stay in memory. That means the save's directory has to stay put while the game runs, so pass SaveInfo.directory
+    to the Autosaver's `keep`. Pass the SaveInfo to LevelManager.restore() to get the other levels back.
+    """
+    directory = current_save(path)
+    if directory is None:
+        raise FileNotFoundError(f"No save in {path}")
+    with open(os.path.join(directory, "meta.json")) as file:
+        meta = json.load(file)
+    if meta["version"] != SAVE_VERSION:
+        raise ValueError(f"Unsupported save version {meta['version']} in {directory}")
+    path = directory
+
+    player = level_io.unpack_entity(np.load(os.path.join(path, "player.npy")).tolist()[0])
+    engine = Engine(player=player)
+    engine.turn = meta["turn"]
+
+    arrays = level_io.load_level_arrays(os.path.join(path, meta["current"]), mmap_mode="c")
+    game_map = level_io.unpack_level(
+        arrays, engine, view_width, view_height, use_entity_store=use_entity_store, share_arrays=True
+    )
+    player.place(player.map_x, player.map_y, game_map)
+    game_map.focus_viewport(player.map_x, player.map_y)
+    engine.game_map = game_map
+    engine.update_fov()
+
+    info = SaveInfo(
+        directory=directory,
+        depth=meta["depth"],
+        base_seed=meta["base_seed"],
+        player_positions={int(depth): tuple(position) for depth, position in meta["player_positions"].items()},
+        level_files={int(depth): os.path.join(path, name) for depth, name in meta["levels"].items()},
+    )
+    return engine, info
+
+
+class Autosaver:
+    """
+    Saves the game every `every` turns without holding up the game.
+
+    The snapshot is taken on the main thread when on_turn() is called; all the file work happens on a single
+    background thread. If the previous save is still being written when the next one is due, that one is skipped
+    rather than queued, so a slow disk can't pile up snapshots in memory.
+
+    A save that fails (disk full, permissions, ...) doesn't stop the game: the error goes in the message log and in
+    `errors`, and the next save is tried as usual. `keep` is passed on to write_snapshot.
+    """
+
+    def __init__(
+            self, engine: Engine, path: str, every: int = 100, level_manager: Optional[LevelManager] = None,
+            keep: Collection[str] = (),
+    ):
+        self.engine = engine
+        self.path = path
+        self.every = every
+        self.level_manager = level_manager
+        self.keep = tuple(keep)
+        self.saves = 0  # Saves started.
+        self.skipped = 0  # Saves skipped because the previous one was still being written.
+        self.errors: List[BaseException] = []  # Saves that failed.
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="autosave")
+        self._pending: Optional[Future] = None
+
+    def on_turn(self) -> None:
+        """Call once a turn, after it's over."""
+        self._check_pending()
+        if self.engine.turn % self.every == 0 and self.engine.player.is_alive:
+            self.save()
+
+    def _check_pending(self) -> None:
+        """Report the outcome of the last save once it's done."""
+        if self._pending is None or not self._pending.done():
+            return
+        error = self._pending.exception()
+        self._pending = None
+        if error is not None:
+            self.errors.append(error)
+            self.engine.message_log.add(self.engine.turn, "autosave_failed", str(error))
+
+    def save(self) -> bool:
+        """Start a save in the background. Returns False if one was still running, so this one was skipped."""
+        self._check_pending()
+        if self._pending is not None:
+            self.skipped += 1
+            return False
+        snap = snapshot(self.engine, self.level_manager)
+        self._pending = self._executor.submit(write_snapshot, snap, self.path, self.keep)
+        self.saves += 1
+        return True
+
+    def close(self) -> None:
+        """Wait for the save that's being written, if any."""
+        self._executor.shutdown(wait=True)
+        self._check_pending()
+
+    def __enter__(self) -> Autosaver:
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
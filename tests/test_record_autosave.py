@@ -0,0 +1,70 @@
+import os
+
+from actions import WaitAction
+from engine import Engine
+import entity_factories
+from level_manager import LevelManager
+from level_pipeline import LevelPipeline
+from main import start_autosaver
+from replay import ReplayRecorder
+from save_game import current_save, load_game, save_game
+
+PARAMS = dict(
+    max_rooms=30, room_min_size=6, room_max_size=10, map_width=80, map_height=45, view_width=80, view_height=45,
+    max_monsters_per_room=2,
+)
+
+
+def new_engine() -> Engine:
+    engine = Engine(player=entity_factories.player.clone())
+    engine.player.fighter.max_hp = engine.player.fighter.hp = 10 ** 6  # Nobody dies before the autosave is due.
+    return engine
+
+
+def play_session(tmp_path, save_path: str, recording: bool) -> None:
+    """What main.py does for a new game, minus the window: 120 turns with autosaves due every 50."""
+    engine = new_engine()
+    with LevelPipeline(PARAMS, base_seed=2) as levels, LevelManager(engine, levels) as level_manager, start_autosaver(
+        engine, save_path, 50, level_manager, None, recording=recording,
+    ) as autosaver:
+        level_manager.goto(1)
+        engine.autosaver = autosaver
+        if recording:
+            engine.recorder = ReplayRecorder(
+                str(tmp_path / "run.rpl"), seed=2, builder="pipeline", params=PARAMS, engine=engine
+            )
+        for _ in range(120):
+            engine.event_handler.handle_action(WaitAction(engine.player))
+        if engine.recorder is not None:
+            engine.recorder.close()
+        engine.path_service.close()
+
+
+def existing_save(save_path: str) -> str:
+    engine = new_engine()
+    with LevelPipeline(PARAMS, base_seed=1) as levels, LevelManager(engine, levels) as level_manager:
+        level_manager.goto(1)
+        save_game(engine, save_path, level_manager)
+    return current_save(save_path)
+
+
+def test_recording_keeps_the_existing_save(tmp_path):
+    save_path = str(tmp_path / "savegame")
+    before = existing_save(save_path)
+
+    play_session(tmp_path, save_path, recording=True)
+
+    assert current_save(save_path) == before
+    assert os.path.isdir(before)
+    _, info = load_game(save_path, PARAMS["view_width"], PARAMS["view_height"])
+    assert info.base_seed == 1
+    assert os.path.getsize(tmp_path / "run.rpl") > 0
+
+
+def test_playing_without_recording_autosaves(tmp_path):
+    save_path = str(tmp_path / "savegame")
+    before = existing_save(save_path)
+
+    play_session(tmp_path, save_path, recording=False)
+
+    assert current_save(save_path) != before
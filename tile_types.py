@@ -1,4 +1,4 @@
-from typing import Tuple
+from typing import List, Tuple
 
 import numpy as np  # type: ignore
 
@@ -22,15 +22,41 @@ tile_dt = np.dtype(
 )
 
 
+# Maps don't store tile_dt records, just the id of each cell's tile type. The ids index into the tile registry below.
+tile_id_dt = np.dtype(np.uint8)
+
+"""
+Tile registry. TILES holds the tile_dt record of every tile type, indexed by tile id, and the other tables are its
+columns pulled out into their own arrays. Anything that needs a property of the map's tiles gathers it from these,
+e.g. WALKABLE[game_map.map_tiles] or LIGHT[game_map.viewport_tiles].
+"""
+_registered_tiles: List[Tuple] = []
+TILES = np.zeros(0, dtype=tile_dt)
+WALKABLE = TILES["walkable"]
+TRANSPARENT = TILES["transparent"]
+DARK = TILES["dark"]
+LIGHT = TILES["light"]
+
+
 def new_tile(
         *,  # Enforce the use of keywords, so that parameter order doesn't matter.
         walkable: int,
         transparent: int,
         dark: Tuple[int, Tuple[int, int, int], Tuple[int, int, int]],
         light: Tuple[int, Tuple[int, int, int], Tuple[int, int, int]],
-) -> np.ndarray:
-    """Helper function for defining individual tile types"""
-    return np.array((walkable, transparent, dark, light), dtype=tile_dt)
+) -> int:
+    """Helper function for defining individual tile types. Adds the tile to the registry and returns its id."""
+    global TILES, WALKABLE, TRANSPARENT, DARK, LIGHT
+    if len(_registered_tiles) > np.iinfo(tile_id_dt).max:
+        raise ValueError("Too many tile types for tile_id_dt.")
+
+    _registered_tiles.append((walkable, transparent, dark, light))
+    TILES = np.array(_registered_tiles, dtype=tile_dt)
+    WALKABLE = np.ascontiguousarray(TILES["walkable"])
+    TRANSPARENT = np.ascontiguousarray(TILES["transparent"])
+    DARK = np.ascontiguousarray(TILES["dark"])
+    LIGHT = np.ascontiguousarray(TILES["light"])
+    return len(_registered_tiles) - 1
 
 
 # SHROUD represents unexplored, unseen tiles
@@ -0,0 +1,156 @@
+from __future__ import annotations
+
+from collections import Counter, deque
+import csv
+import time
+from typing import Any, Deque, Dict, List, Optional
+
+import numpy as np  # type: ignore
+
+# The phases of a turn that get timed. A turn's "render" is the frame that first shows its outcome.
+PHASES = ("player_action", "enemy_turns", "fov", "render")
+
+
+class _NullTimer:
+    """What phase() hands out while profiling is off."""
+
+    def __enter__(self) -> None:
+        pass
+
+    def __exit__(self, *exc_info: Any) -> None:
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _PhaseTimer:
+    __slots__ = ("profiler", "phase", "start")
+
+    def __init__(self, profiler: TurnProfiler, phase: str):
+        self.profiler = profiler
+        self.phase = phase
+
+    def __enter__(self) -> None:
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.profiler.record(self.phase, time.perf_counter() - self.start)
+
+
+class TurnProfiler:
+    """
+    Times each phase of a turn so lag can be traced to a subsystem without attaching a profiler.
+
+    Wrap a phase in `with profiler.phase(name):`, call end_turn() once the turn's logic is over and end_frame() once
+    the frame after it has been presented. The turn's row stays open until then, so it gets the render time of the
+    frame that shows it rather than the one before. If no frame comes (headless runs, or several turns handled before
+    the next frame), the row is closed when the next turn starts. Frames drawn with no turn waiting, like redraws
+    after the window was covered, only count towards the percentiles.
+
+    The last `history` samples of each phase are kept for the rolling percentiles, and one row per turn is kept for
+    export_csv(). BaseAI counts its get_path_to calls here, per AI class. While disabled, phase() returns a
+    do-nothing context manager and nothing is recorded.
+    """
+
+    def __init__(self, history: int = 300, max_rows: int = 100_000):
+        self.enabled = False
+        self.samples: Dict[str, Deque[float]] = {phase: deque(maxlen=history) for phase in PHASES}
+        self.rows: Deque[Dict[str, Any]] = deque(maxlen=max_rows)
+        self.path_calls: Counter = Counter()  # Totals per AI class since profiling was enabled.
+        self._turn: Dict[str, float] = {}
+        self._turn_path_calls: Counter = Counter()
+        self._ended_turn: Optional[int] = None  # Set by end_turn() until the row is closed.
+
+    def toggle(self) -> None:
+        self.enabled = not self.enabled
+
+    def phase(self, name: str) -> Any:
+        if not self.enabled:
+            return _NULL_TIMER
+        return _PhaseTimer(self, name)
+
+    def record(self, phase: str, seconds: float) -> None:
+        self.samples[phase].append(seconds)
+        if phase == "render":
+            if self._ended_turn is None:
+                return  # Not the frame of any turn.
+        elif self._ended_turn is not None:
+            self._close_row()  # A new turn started before a frame showed the last one.
+        self._turn[phase] = self._turn.get(phase, 0.0) + seconds
+
+    def count_path_call(self, ai_class: str) -> None:
+        if self.enabled:
+            if self._ended_turn is not None:
+                self._close_row()
+            self._turn_path_calls[ai_class] += 1
+
+    def end_turn(self, turn: int) -> None:
+        """The turn's logic is done. Its row is closed by the next end_frame(), or when the next turn starts."""
+        if not self.enabled:
+            return
+        if self._ended_turn is not None:
+            self._close_row()
+        self._ended_turn = turn
+
+    def end_frame(self) -> None:
+        """A frame was presented. Close off the row of the turn it showed, if any."""
+        if self._ended_turn is not None:
+            self._close_row()
+
+    def _close_row(self) -> None:
+        row: Dict[str, Any] = {"turn": self._ended_turn}
+        for phase in PHASES:
+            row[phase] = self._turn.get(phase, 0.0)
+        row["path_calls"] = dict(self._turn_path_calls)
+        self.rows.append(row)
+        self.path_calls.update(self._turn_path_calls)
+        self._turn = {}
+        self._turn_path_calls = Counter()
+        self._ended_turn = None
+
+    def percentile(self, phase: str, q: float) -> float:
+        """Return the q-th percentile of the recent samples of a phase, in seconds (0 if there are none)."""
+        samples = self.samples[phase]
+        if not samples:
+            return 0.0
+        return float(np.percentile(np.fromiter(samples, dtype=np.float64, count=len(samples)), q))
+
+    def path_calls_per_turn(self) -> float:
+        """Average get_path_to calls per turn over the recorded turns."""
+        if not self.rows:
+            return 0.0
+        return sum(self.path_calls.values()) / len(self.rows)
+
+    def export_csv(self, path: str) -> None:
+        """Write one line per recorded turn: phase times in milliseconds, then get_path_to calls per AI class."""
+        if self._ended_turn is not None:
+            self._close_row()  # The last turn, whether or not a frame showed it.
+        ai_classes: List[str] = sorted({ai_class for row in self.rows for ai_class in row["path_calls"]})
+        with open(path, "w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(["turn", *(f"{phase}_ms" for phase in PHASES), *(f"{name}_paths" for name in ai_classes)])
+            for row in self.rows:
+                writer.writerow(
+                    [
+                        row["turn"],
+                        *(f"{row[phase] * 1000:.3f}" for phase in PHASES),
+                        *(row["path_calls"].get(name, 0) for name in ai_classes),
+                    ]
+                )
+
+    def overlay_lines(self) -> List[str]:
+        """The overlay text: 95th percentile of each phase in milliseconds, and pathfinding calls. Under 20 columns."""
+        def p95(phase: str) -> float:
+            return self.percentile(phase, 95) * 1000
+
+        return [
+            f"act{p95('player_action'):5.1f} ai {p95('enemy_turns'):5.1f}",
+            f"fov{p95('fov'):5.1f} drw{p95('render'):5.1f}",
+            f"paths/turn {self.path_calls_per_turn():5.1f}",
+        ]
+
+
+def profile_csv_name() -> str:
+    """A timestamped file name for exports triggered from inside the game."""
+    return time.strftime("turn_profile_%Y%m%d_%H%M%S.csv")
@@ -0,0 +1,112 @@
+from __future__ import annotations
+
+import heapq
+from typing import List, Optional, Set, Tuple, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from engine import Engine
+    from entity import Actor
+    from game_map import GameMap
+
+# Game time that passes per player turn. An actor with speed 100 acts once per player turn, 200 twice, 50 every other.
+TURN_TICKS = 100
+NORMAL_SPEED = 100
+
+
+class TurnScheduler:
+    """
+    Decides which enemies act on each player turn.
+
+    Awake actors sit in a priority queue ordered by the tick they're next ready at (then by entity id, so ties always
+    resolve the same way). Each player turn moves the clock forward TURN_TICKS, and everyone whose time has come acts,
+    in rounds of actors that are ready at the same tick. After acting an actor is due again after
+    TURN_TICKS * NORMAL_SPEED / speed ticks, so how far its ready tick is behind the clock is its banked energy.
+
+    An actor that ends its turn with nothing to do (no path, no last known player position) and is outside the wake
+    radius around the player is put to sleep: it's simply not put back in the queue. Every turn the living actors in
+    the wake radius around the player are looked up and woken. The wake radius is never smaller than the FOV radius,
+    so that also covers actors coming into view. Sleeping actors cost nothing, so a turn costs time for the
+    awake actors only, however many are on the level.
+    """
+
+    def __init__(self, engine: Engine, wake_radius: int = 12):
+        self.engine = engine
+        self.wake_radius = wake_radius
+        self.game_map: Optional[GameMap] = None
+        self.clock = 0
+        self._queue: List[Tuple[int, int, Actor]] = []  # (ready_at, entity id, actor)
+        self._awake: Set[Actor] = set()
+
+    @property
+    def awake_count(self) -> int:
+        return len(self._awake)
+
+    def reset(self, game_map: GameMap) -> None:
+        """Forget everything, e.g. for a new level. Actors are woken again as the player gets near them."""
+        self.game_map = game_map
+        self.clock = 0
+        self._queue = []
+        self._awake = set()
+
+    def wake(self, actor: Actor, ready_at: Optional[int] = None) -> None:
+        if actor in self._awake:
+            return
+        self._awake.add(actor)
+        heapq.heappush(
+            self._queue, (self.clock if ready_at is None else ready_at, self.game_map.entity_id(actor), actor)
+        )
+
+    def _radius(self) -> int:
+        return max(self.wake_radius, self.engine.fov_radius)
+
+    def wake_nearby(self) -> None:
+        """Wake every actor inside the wake radius around the player."""
+        game_map = self.game_map
+        player = self.engine.player
+        radius = self._radius()
+        x0 = max(0, player.map_x - radius)
+        y0 = max(0, player.map_y - radius)
+        x1 = min(game_map.map_width, player.map_x + radius + 1)
+        y1 = min(game_map.map_height, player.map_y + radius + 1)
+        for actor in game_map.living_actors_in_rect(x0, y0, x1, y1):
+            if actor is not player:
+                self.wake(actor)
+
+    def should_sleep(self, actor: Actor) -> bool:
+        ai = actor.ai
+        if ai.path or getattr(ai, "last_seen", None):
+            return False  # Still on its way somewhere.
+        player = self.engine.player
+        distance = max(abs(actor.map_x - player.map_x), abs(actor.map_y - player.map_y))
+        return distance > self._radius() and not self.game_map.visible[actor.map_x, actor.map_y]
+
+    def run_turn(self) -> None:
+        """Advance the clock by one player turn and let every actor that's ready act."""
+        game_map = self.engine.game_map
+        if game_map is not self.game_map:
+            self.reset(game_map)
+        self.clock += TURN_TICKS
+        self.wake_nearby()
+
+        queue = self._queue
+        while queue and queue[0][0] <= self.clock:
+            ready_at = queue[0][0]
+            acting: List[Actor] = []
+            while queue and queue[0][0] == ready_at:
+                _, _, actor = heapq.heappop(queue)
+                if actor.is_alive and actor.game_map is game_map:
+                    acting.append(actor)
+                else:
+                    self._awake.discard(actor)  # Dead or gone.
+            if not acting:
+                continue
+
+            # Popped in (ready_at, entity id) order, so this round is already sorted by entity id.
+            self.engine.perform_enemy_round(acting)
+
+            for actor in acting:
+                if not actor.is_alive or actor.game_map is not game_map or self.should_sleep(actor):
+                    self._awake.discard(actor)
+                else:
+                    interval = max(1, TURN_TICKS * NORMAL_SPEED // actor.speed)
+                    heapq.heappush(queue, (ready_at + interval, game_map.entity_id(actor), actor))